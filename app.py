@@ -1,43 +1,100 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
 import os
+import csv
 
 import streamlit as st
 import pandas as pd
 from PIL import Image
 
-from main import retrieve_csv
+from main import retrieve_csv, OCR_FINAL_PATH, TABLE_INPUT_PATH, IMAGE_EXTENSIONS, BACKGROUND_COLOR, GOLD_ICONS_COLOR, RED_ICONS_COLOR
 
-OCR_FINAL_PATH = "outputs"
-TABLE_INPUT_PATH = "images"
 DEBUG_PATH = "images/debug/"
 
-BACKGROUND_COLOR = (163, 151, 152)
-GOLD_ICONS_COLOR = (158, 130, 90)
-RED_ICONS_COLOR = (163, 151, 152)
+# the debug images are shown in 4 columns, they don't need to be decoded at full resolution
+PREVIEW_MAX_WIDTH = 1024
+# header and file suffix of the images shown in the debug tab, from left to right
+DEBUG_IMAGES = (
+    ("Table extraction", "_extracted_table.jpg"),
+    ("Icons removal", "_without_icons.png"),
+    ("Lines removal", "_without_lines.png"),
+    ("Text box detection", "_final_bounding_boxes.jpg"),
+)
+# the intermediate images of the images processed before they were stored as PNG only exist as JPEG,
+# their OCR is not performed again as their csv already exists
+LEGACY_DEBUG_IMAGE_SUFFIXES = {
+    "_without_icons.png": "_without_icons.jpg",
+    "_without_lines.png": "_without_lines.jpg",
+}
 
 
 # files handling
-def collect_images():
-    img_path = []
-    for file in os.listdir(Path("images")):
-        if file.endswith(".jpg"):
-            img_path.append(file)
-    return img_path
+# folders listings are cached between reruns, as Streamlit reruns the whole script on every button click
+@st.cache_data(ttl=30)
+def collect_images() -> list[str]:
+    # scandir entries already know whether they are files, no extra system call is needed per entry
+    with os.scandir(TABLE_INPUT_PATH) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+
+def collect_processed_images() -> set[str]:
+    # creating a csv updates the folder modification time, which invalidates the cached listing
+    return _collect_processed_images(modification_time=os.path.getmtime(OCR_FINAL_PATH))
+
+@st.cache_data
+def _collect_processed_images(modification_time:float) -> set[str]:
+    with os.scandir(OCR_FINAL_PATH) as entries:
+        return {Path(entry.name).stem for entry in entries}
+
+def get_debug_image_path(image_stem:str, suffix:str) -> str:
+    path_image = DEBUG_PATH + image_stem + suffix
+    if suffix in LEGACY_DEBUG_IMAGE_SUFFIXES and not os.path.exists(path_image):
+        return DEBUG_PATH + image_stem + LEGACY_DEBUG_IMAGE_SUFFIXES[suffix]
+    return path_image
+
+# OCR runs in a background thread, so the script keeps rendering while it is performed
+# the executor is shared by all the reruns, a single OCR runs at a time as each one already uses all the cores
+@st.cache_resource
+def get_ocr_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=1)
+
+def submit_ocr(image_path:str) -> Future | None:
+    if Path(image_path).stem in collect_processed_images():
+        return None
+    # the futures are kept between reruns, so an OCR is only submitted once per image
+    ocr_futures = st.session_state.ocr_futures
+    if image_path not in ocr_futures:
+        ocr_futures[image_path] = get_ocr_executor().submit(
+            retrieve_csv,
+            image_path=image_path,
+            background_color=BACKGROUND_COLOR,
+            icons_colors=[GOLD_ICONS_COLOR,RED_ICONS_COLOR]
+            )
+    return ocr_futures[image_path]
 
 def get_ocr(image_path:str) -> None:
-    ocrNotPerformed = True
-    for file in os.listdir(Path(OCR_FINAL_PATH)):
-        path_file = Path(file)
-        if path_file.stem == Path(image_path).stem:
-            print("OCR already performed")
-            ocrNotPerformed = False
-            break
-    if ocrNotPerformed:
-        retrieve_csv(
-        image_path=image_path,
-        background_color=BACKGROUND_COLOR,
-        icons_colors=[GOLD_ICONS_COLOR,RED_ICONS_COLOR]
-        )
+    future = submit_ocr(image_path=image_path)
+    if future is None:
+        print("OCR already performed")
+        return
+    # the future is removed even when the OCR failed, so the error is not raised again on the next rerun
+    try:
+        if not future.done():
+            with st.status("Performing OCR..."):
+                future.result()
+        # result() raises the errors of the OCR, if any
+        future.result()
+    finally:
+        st.session_state.ocr_futures.pop(image_path, None)
+
+def evict_ocr_futures(image_paths:set[str]) -> None:
+    '''
+    Removes the OCR futures which are done and no longer needed, e.g. the ones of the images prefetched but skipped by the user.
+    The futures still running are kept, so their OCR is not submitted twice.
+    - image_paths: the paths of the images whose OCR futures are still needed
+    '''
+    ocr_futures = st.session_state.ocr_futures
+    for image_path in [path for path, future in ocr_futures.items() if future.done() and path not in image_paths]:
+        del ocr_futures[image_path]
 
 # buttons next and previous
 def next(): 
@@ -45,12 +102,48 @@ def next():
 def prev(): 
     st.session_state.counter -= 1
 
+# images are decoded once per file version, Streamlit reruns the whole script on every button click
+# the modification time is part of the cache key, so images regenerated by a new OCR run are decoded again
+def load_rotated_image(path_image:str) -> Image.Image:
+    return _load_rotated_image(path_image=path_image, modification_time=os.path.getmtime(path_image))
+
+def load_images(paths_images:tuple[str, ...]) -> list[Image.Image]:
+    return _load_images(paths_images=paths_images, modification_times=tuple(os.path.getmtime(path) for path in paths_images))
+
+@st.cache_data
+def _load_images(paths_images:tuple[str, ...], modification_times:tuple[float, ...]) -> list[Image.Image]:
+    # PIL releases the GIL while decoding, so the images are decoded in parallel threads
+    def decode(path_image:str) -> Image.Image:
+        image = Image.open(Path(path_image))
+        # thumbnail decodes JPEG images directly at a reduced scale before resizing them, 
+        # and forces the decoding within the thread as images are opened lazily
+        image.thumbnail(size=(PREVIEW_MAX_WIDTH, image.height))
+        return image
+    with ThreadPoolExecutor(max_workers=len(paths_images)) as executor:
+        return list(executor.map(decode, paths_images))
+
+@st.cache_data
+def _load_rotated_image(path_image:str, modification_time:float) -> Image.Image:
+    # image is not shown vertical by default
+    # transposing only swaps the pixels, while rotate(-90) resamples the image through an affine transformation
+    return Image.open(Path(path_image)).transpose(Image.Transpose.ROTATE_270)
+
+# the csv is edited from the app, the modification time ensures the edited version is loaded after a submission
 def load_df(path_ocr:str) -> pd.DataFrame:
-    return pd.read_csv(filepath_or_buffer=Path(path_ocr), delimiter="|")
+    return _load_df(path_ocr=path_ocr, modification_time=os.path.getmtime(path_ocr))
+
+@st.cache_data
+def _load_df(path_ocr:str, modification_time:float) -> pd.DataFrame:
+    # the OCR table is a few dozen rows of text, the csv module parses it without any type inference
+    with open(Path(path_ocr), encoding="utf-8", newline="") as file:
+        column_names, *rows = csv.reader(file, delimiter="|")
+    return pd.DataFrame(data=rows, columns=column_names)
 
 # INITIALISATION
 if 'counter' not in st.session_state: 
     st.session_state.counter = 0
+if 'ocr_futures' not in st.session_state:
+    st.session_state.ocr_futures = {}
 
 table_imgs = collect_images()
 
@@ -68,15 +161,20 @@ def st_main():
         with tab1:
             ## Select image based on the current counter
             path_image = TABLE_INPUT_PATH + "/" + table_imgs[st.session_state.counter]
-            # image is not shown vertical by default
-            image = Image.open(Path(path_image)).rotate(-90)
+            image = load_rotated_image(path_image=path_image)
 
             col1, col2 = st.columns(2)
             with col1:
                 st.header(f"Input image: {Path(path_image).stem} ")
                 st.image(image=image)
-            # performs OCR if needed
+            # performs OCR if needed, the next image is processed in the background while this one is reviewed
             get_ocr(image_path=path_image)
+            needed_image_paths = {path_image}
+            if st.session_state.counter + 1 < len(table_imgs):
+                next_path_image = TABLE_INPUT_PATH + "/" + table_imgs[st.session_state.counter + 1]
+                submit_ocr(image_path=next_path_image)
+                needed_image_paths.add(next_path_image)
+            evict_ocr_futures(image_paths=needed_image_paths)
             # loads the dataframe containing the OCR results
             path_ocr = OCR_FINAL_PATH + "/" + Path(path_image).stem + ".csv"
             processed_df = load_df(path_ocr=path_ocr)   
@@ -93,28 +191,13 @@ def st_main():
                     edited_df.to_csv(path_or_buf=Path(path_ocr), sep="|", index=False)
         
         with tab2:
-            path_image_table_extraction = DEBUG_PATH + table_imgs[st.session_state.counter].split(".jpg")[0] + "_extracted_table.jpg"
-            image_table_extraction = Image.open(Path(path_image_table_extraction))
-            path_image_icons_removal = DEBUG_PATH + table_imgs[st.session_state.counter].split(".jpg")[0] + "_without_icons.jpg"
-            image_icons_removal = Image.open(Path(path_image_icons_removal))
-            path_image_lines_removal = DEBUG_PATH + table_imgs[st.session_state.counter].split(".jpg")[0] + "_without_lines.jpg"
-            image_lines_removal = Image.open(Path(path_image_lines_removal))
-            path_image_ocr = DEBUG_PATH + table_imgs[st.session_state.counter].split(".jpg")[0] + "_final_bounding_boxes.jpg"
-            image_ocr = Image.open(Path(path_image_ocr))
-            col1, col2, col3, col4 = st.columns(4)
-
-            with col1:
-                st.header(f"Table extraction")
-                st.image(image=image_table_extraction)
-            with col2:
-                st.header(f"Icons removal")
-                st.image(image=image_icons_removal)
-            with col3:
-                st.header(f"Lines removal")
-                st.image(image=image_lines_removal)
-            with col4:
-                st.header(f"Text box detection")
-                st.image(image=image_ocr)
+            image_stem = Path(table_imgs[st.session_state.counter]).stem
+            debug_images = load_images(paths_images=tuple(get_debug_image_path(image_stem=image_stem, suffix=suffix) for _, suffix in DEBUG_IMAGES))
+            
+            for col, (header, _), debug_image in zip(st.columns(len(DEBUG_IMAGES)), DEBUG_IMAGES, debug_images):
+                with col:
+                    st.header(header)
+                    st.image(image=debug_image)
 
 st_main()
 
@@ -0,0 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import os
+
+# Tesseract parallelizes each recognition with OpenMP threads, and the Numba colour masks with one thread per core:
+# both compete with the other images processes for the cores.
+# The limits are read when Tesseract and Numba are loaded, so they must be set before the project modules are imported.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+os.environ.setdefault("NUMBA_NUM_THREADS", "1")
+
+from main import retrieve_csv, OCR_FINAL_PATH, TABLE_INPUT_PATH, IMAGE_EXTENSIONS, BACKGROUND_COLOR, GOLD_ICONS_COLOR, RED_ICONS_COLOR
+import image_processing
+
+# Offline conversion of all the images at once, the Streamlit app keeps performing OCR one image at a time.
+# Each image is independent, so the images are dispatched to a pool of processes.
+
+def collect_images_to_process() -> list[str]:
+    '''
+    Returns the path of the images from the input folder for which OCR was not performed yet.
+    '''
+    processed_images = {Path(file).stem for file in os.listdir(Path(OCR_FINAL_PATH))}
+    with os.scandir(TABLE_INPUT_PATH) as entries:
+        return [
+            TABLE_INPUT_PATH + "/" + entry.name for entry in entries
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS) and Path(entry.name).stem not in processed_images
+            ]
+
+def _init_batch_worker() -> None:
+    # parallelism comes from the processes, OpenCV internal threads would compete with the other images for the cores
+    image_processing.set_opencv_threads(nbr_threads=1)
+
+def _extract_csv(image_path:str) -> None:
+    # OCR also runs in a pool of threads: one OCR thread per image avoids competing with the other images processes
+    retrieve_csv(
+        image_path=image_path,
+        background_color=BACKGROUND_COLOR,
+        icons_colors=[GOLD_ICONS_COLOR, RED_ICONS_COLOR],
+        ocr_max_workers=1
+        )
+
+
+def main():
+    image_paths = collect_images_to_process()
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_batch_worker) as executor:
+        futures = {executor.submit(_extract_csv, image_path): image_path for image_path in image_paths}
+        for future in as_completed(futures):
+            image_path = futures[future]
+            # an image whose table is not detected is reported, the other images of the batch are still processed
+            try:
+                future.result()
+            except Exception as error:
+                print("OCR failed: " + image_path + " (" + str(error) + ")")
+            else:
+                print("OCR performed: " + image_path)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 from dataclasses import dataclass, field
 
+import numpy as np
+from numba import njit, prange
+
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
@@ -22,8 +28,9 @@ class Color:
     def get_hsv_color(self) -> tuple[float,float,float]: 
         '''
         Converts RGB (Red, Green, Blue) color provided to the HSV (Hue, Saturation, Value) color mode.
+        The hue is in degrees, the saturation and value between 0 and 1, without the 8-bit quantization of OpenCV.
         '''
-        if not (0<self.rgb_color[0]<255 and 0<self.rgb_color[1]<255 and 0<self.rgb_color[2]<255):
+        if not all(0 <= channel <= 255 for channel in self.rgb_color):
             raise ValueError("R,G,B values should be between 0 and 255")
 
         r, g, b = self.rgb_color[0] / 255.0, self.rgb_color[1] / 255.0, self.rgb_color[2] / 255.0  # Normalize to [0, 1]
@@ -49,46 +56,80 @@ class Color:
         return round(h, 2), round(s, 2), round(v, 2)
 
     # OpenCV implementes HSV in a specific manner for optimization purposes
+    # the color is converted by OpenCV itself, so its boundaries match the conversion applied to the filtered images
     def get_opencv_hsv_color(self) -> tuple[int, int, int]:
-        h, s, v = self.get_hsv_color()
-        h_opencv = h / 2
-        s_opencv = s * 255
-        v_opencv = v * 255
-        return round(h_opencv), round(s_opencv), round(v_opencv)
+        if not all(0 <= channel <= 255 for channel in self.rgb_color):
+            raise ValueError("R,G,B values should be between 0 and 255")
+        return image_processing.convert_color_from_rgb_to_hsv(color=self.rgb_color)
     
     def set_hue(self) -> None:
         self.h = self.get_opencv_hsv_color()[0]
     
     # boundaries calculation methods are explained here: https://docs.opencv.org/3.4/df/d9d/tutorial_py_colorspaces.html 
-    def get_hsv_boundaries(self, tolerance_h: int) -> list[tuple[list[int], list[int]]]:
+    def get_hsv_boundaries(self, tolerance_h: int) -> list[tuple[np.ndarray, np.ndarray]]:
         '''
-        Computes the HSV boundaries to apply for a given HSV color, computed with OpenCV definition of HSV.
-        - h: value of hue from the HSV color, between 0 and 180
+        Computes the HSV boundaries to apply for the color, computed with OpenCV definition of HSV.
         - tolerance_h: margin around a hue to account to variations due to original image quality, defaulted to 10
         '''
-        # because of hue overlaps (360 degrees values), we include edge conditions to cover the
-        # h = 8, h-10 = -2 -> [178,180], h+10 = 18 -> [0,18]
-        # h = 172, h-10 = 162 -> [162, 180], h+10 = 182 -> [0,2]
         self.set_hue()
-        boundaries = []
-        if self.h < tolerance_h:
-            boundaries1 = [self.h - tolerance_h + 180, 20, 20], [180, 255, 255]
-            boundaries2 = [0, 20, 20], [self.h + tolerance_h, 255, 255]
-            boundaries.append(boundaries1)
-            boundaries.append(boundaries2)
-        elif self.h > 180 - tolerance_h:
-            boundaries1 = [self.h - tolerance_h, 20, 20], [180, 255, 255]
-            boundaries2 = [0, 20, 20], [(self.h + tolerance_h) % 180, 255, 255]
-            boundaries.append(boundaries1)
-            boundaries.append(boundaries2)
-        else:     
-            lower = [self.h - tolerance_h, 20, 20]
-            upper = [self.h + tolerance_h, 255, 255]
-            boundaries.append((lower, upper))
-        return boundaries
+        return compute_hsv_boundaries(h=self.h, tolerance_h=tolerance_h)
+
+
+def compute_hsv_boundaries(h: int, tolerance_h: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    '''
+    Computes the HSV boundaries to apply for a given hue, as uint8 arrays which can be passed as is to OpenCV.
+    - h: value of hue from the HSV color, between 0 and 180
+    - tolerance_h: margin around a hue to account to variations due to original image quality
+    '''
+    # because of hue overlaps (360 degrees values), we include edge conditions to cover the
+    # h = 8, h-10 = -2 -> [178,180], h+10 = 18 -> [0,18]
+    # h = 172, h-10 = 162 -> [162, 180], h+10 = 182 -> [0,2]
+    if h < tolerance_h:
+        hue_ranges = [(h - tolerance_h + 180, 180), (0, h + tolerance_h)]
+    elif h > 180 - tolerance_h:
+        hue_ranges = [(h - tolerance_h, 180), (0, (h + tolerance_h) % 180)]
+    else:
+        hue_ranges = [(h - tolerance_h, h + tolerance_h)]
+    return [
+        (np.array([lower_h, 20, 20], dtype=np.uint8), np.array([upper_h, 255, 255], dtype=np.uint8)) 
+        for lower_h, upper_h in hue_ranges
+        ]
+
+
+# compiled once and cached on disk, each pixel is read once and tested against all the ranges,
+# instead of one full pass over the image per range followed by the union of the masks
+@njit(cache=True, parallel=True)
+def _create_multi_range_mask(image:np.ndarray, lower_boundaries:np.ndarray, upper_boundaries:np.ndarray) -> np.ndarray:
+    height, width = image.shape[0], image.shape[1]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for i in prange(height):
+        for j in range(width):
+            for k in range(lower_boundaries.shape[0]):
+                if (lower_boundaries[k, 0] <= image[i, j, 0] <= upper_boundaries[k, 0]
+                    and lower_boundaries[k, 1] <= image[i, j, 1] <= upper_boundaries[k, 1]
+                    and lower_boundaries[k, 2] <= image[i, j, 2] <= upper_boundaries[k, 2]):
+                    mask[i, j] = 255
+                    break
+    return mask
 
+def create_colors_mask(hsv: image_processing.Image, colors: list[Color], hue_tolerance: int) -> np.ndarray:
+    '''
+    Creates the mask of the pixels matching any of the colors provided, in a single pass over the image.
+    - hsv: image we want to filter colors from, represented via the HSV channels computed in OpenCV
+    - colors: the Color objects corresponding to the colors we want to filter
+    - hue_tolerance: the tolerance used to create the HSV color boundaries of each color
+    '''
+    # when the hue wraps around 180, a color has several ranges, they are all tested within the same pass
+    boundaries = [boundary for color in colors for boundary in color.get_hsv_boundaries(tolerance_h=hue_tolerance)]
+    lower_boundaries = np.stack([lower for lower, _ in boundaries])
+    upper_boundaries = np.stack([upper for _, upper in boundaries])
+    return _create_multi_range_mask(hsv, lower_boundaries, upper_boundaries)
 
 
+# rectangular kernels are separable, OpenCV applies them as a row pass followed by a column pass
+# which is much cheaper than an ellipse of the same size for the gap filling done by the closing
+COLOR_FILTER_KERNEL = image_processing.Kernel(shape=image_processing.KernelShape.RECTANGLE, dimensions=(20,20))
+
 @dataclass
 class ColorFilter:
     '''
@@ -96,44 +137,45 @@ class ColorFilter:
     - image: the image outcome from the OpenCV .imread method
     - color: the Color object corresponding to the color we want to filter 
     - hue_tolerance: the tolerance used to create the HSV color boundaries for filtering, results in [h-10,...] [h+10, ...] intervals
-    - kernel: the Kernel object we want to apply for filtering, defaulted to a 20,20 ellipse
+    - kernel: the Kernel object we want to apply for filtering, defaulted to a 20,20 rectangle
     '''
     color: Color
     image: image_processing.Image
     hue_tolerance: int = 10
-    kernel: image_processing.Kernel = field(default_factory=lambda: image_processing.Kernel(shape=image_processing.KernelShape.ELLIPSE, dimensions=(20,20)))
+    kernel: image_processing.Kernel = field(default_factory=lambda: COLOR_FILTER_KERNEL)
 
     def create_color_mask(self, hsv: image_processing.Image):
         '''
         Creates for a given image and a RGB (Red, Green, Blue) color the mask to apply on the image to filter out the color.
         - hsv: image we want to filter color from, represented via the HSV channels computed in OpenCV 
         '''
-        color_boundaries = self.color.get_hsv_boundaries(tolerance_h=self.hue_tolerance)
-        # mask initialization
-        mask = image_processing.create_mask(image=hsv, boundaries=(color_boundaries[0][0], color_boundaries[0][1]))
-        nbr_boundaries = len(color_boundaries)
-        if nbr_boundaries > 1:
-            for i in range(1, nbr_boundaries):
-                mask += image_processing.create_mask(image=hsv, boundaries=(color_boundaries[i][0], color_boundaries[i][1]))
-        return mask
+        return create_colors_mask(hsv=hsv, colors=[self.color], hue_tolerance=self.hue_tolerance)
     
-    def filter(self) -> image_processing.Image:
+    def filter(self, target_image: image_processing.Image | None = None) -> image_processing.Image:
         '''
         Turns all pixels from the image representing a color within the range provided to black.
+        - target_image: (Optional) the image on which the pixels are turned black, with the same dimensions as the image, e.g. its grayscale version.
+        Defaulted to the image itself.
         '''
         # leverages HSV color mode representation for more accurate filtering
         hsv = image_processing.convert_image_to_hsv(image=self.image)
         mask = self.create_color_mask(hsv=hsv) 
-            
-        # apply a morphology operation, closing: it results in a Dilation followed by Erosion
-        # helps filling small pixel gaps in an area (e.g. holes in a shape because of different lighting conditions)
-        morph_transformer = MorphologicalTransformer(image=mask, operation=MorphologicalOperation.CLOSING, kernel=self.kernel)
-        morph = morph_transformer.apply()
+        return filter_masked_pixels(image=self.image if target_image is None else target_image, mask=mask, kernel=self.kernel)
 
-        mask = 255 - morph
-        filtered_image = image_processing.apply_bitwise_and(image1=self.image, image2=self.image, mask=mask)
-        return filtered_image
 
-    
-    
+def filter_masked_pixels(image: image_processing.Image, mask: np.ndarray, kernel: image_processing.Kernel) -> image_processing.Image:
+    '''
+    Turns all pixels from the image selected by the color mask to black, after filling the small gaps of the mask.
+    - image: the mathematical representation of the image to filter
+    - mask: the binary mask of the pixels to filter, with white pixels for the filtered color
+    - kernel: the Kernel object used for the closing of the mask
+    '''
+    # apply a morphology operation, closing: it results in a Dilation followed by Erosion
+    # helps filling small pixel gaps in an area (e.g. holes in a shape because of different lighting conditions)
+    morph_transformer = MorphologicalTransformer(image=mask, operation=MorphologicalOperation.CLOSING, kernel=kernel)
+    morph = morph_transformer.apply()
+
+    # the closing result is not reused, so it is inverted in place to avoid allocating another mask
+    mask = image_processing.invert_image(image=morph, in_place=True)
+    return image_processing.apply_bitwise_and(image1=image, image2=image, mask=mask)
     
\ No newline at end of file
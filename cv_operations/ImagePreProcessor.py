@@ -1,27 +1,39 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import Protocol
 
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
 
 
 class Thresholder(Protocol):
-    def apply_threshold(self, image:image_processing.Image) -> image_processing.Image:
+    inversion: bool
+
+    def apply_threshold(self, image:image_processing.Image, dst:image_processing.Image | None = None) -> image_processing.Image:
         ...
 
+def get_inverted_thresholder(thresholder:Thresholder) -> Thresholder:
+    '''
+    Returns a copy of the thresholder with the opposite inversion, which thresholds and inverts the image in a single OpenCV call.
+    - thresholder: the thresholder to invert, all the thresholders are dataclasses with an inversion attribute
+    '''
+    return replace(thresholder, inversion=not thresholder.inversion)
+
 @dataclass
 class GlobalThresholder:
     new_value: int = 255
     inversion: bool = False
     static_threshold_value: float = 127
 
-    def apply_threshold(self, image:image_processing.Image):
-        return image_processing.apply_simple_binary_threshold(image=image, threshold_value=self.static_threshold_value, new_pixel_value=self.new_value,inversion=self.inversion)
+    def apply_threshold(self, image:image_processing.Image, dst:image_processing.Image | None = None):
+        return image_processing.apply_simple_binary_threshold(image=image, threshold_value=self.static_threshold_value, new_pixel_value=self.new_value,inversion=self.inversion, dst=dst)
 
 
 @dataclass
@@ -29,8 +41,8 @@ class GlobalOptimizedThresholder:
     new_value: int = 255
     inversion: bool = False
 
-    def apply_threshold(self, image:image_processing.Image):
-        return image_processing.apply_complex_binary_threshold(image=image, new_pixel_value=self.new_value, inversion=self.inversion)
+    def apply_threshold(self, image:image_processing.Image, dst:image_processing.Image | None = None):
+        return image_processing.apply_complex_binary_threshold(image=image, new_pixel_value=self.new_value, inversion=self.inversion, dst=dst)
 
 @dataclass
 class AdaptiveThresholder:
@@ -38,8 +50,8 @@ class AdaptiveThresholder:
     new_value: float = 255
     inversion: bool = False
 
-    def apply_threshold(self, image:image_processing.Image):
-        return image_processing.apply_adaptive_threshold(image=image, method=self.method, new_pixel_value=self.new_value, inversion=self.inversion)
+    def apply_threshold(self, image:image_processing.Image, dst:image_processing.Image | None = None):
+        return image_processing.apply_adaptive_threshold(image=image, method=self.method, new_pixel_value=self.new_value, inversion=self.inversion, dst=dst)
 
 
 
@@ -49,11 +61,23 @@ class ImagePreProcessor:
     Turn a colored image into a black and white binary representation.
     - image: the mathematical representation of the source image
     - thresholder: the type of threshold used to obtain a binary representation of the image
+    - use_umat: if True and OpenCL is available, the grayscale conversion and the threshold are chained on the OpenCL device, 
+    with a single upload of the image and a single download of the result
     '''
     image: image_processing.Image
     thresholder: Thresholder
+    use_umat: bool = False
 
     def apply(self) -> image_processing.Image:
-        self.grayscaled_image = image_processing.convert_image_to_grayscale(image=self.image)
-        self.thresholded_image = self.thresholder.apply_threshold(image=self.grayscaled_image)
-        return self.thresholded_image
\ No newline at end of file
+        if self.use_umat and self.image.ndim == 3 and image_processing.is_opencl_available():
+            return self.apply_on_device()
+        grayscaled_image = image_processing.convert_image_to_grayscale(image=self.image)
+        # the grayscale buffer is only an intermediate when it was allocated here, the threshold is then written into it
+        # an image already grayscaled is returned as is by the conversion, and must not be overwritten
+        dst = grayscaled_image if grayscaled_image is not self.image else None
+        return self.thresholder.apply_threshold(image=grayscaled_image, dst=dst)
+
+    def apply_on_device(self) -> image_processing.Image:
+        # the intermediate grayscale image stays on the device, only the binary image is transferred back
+        grayscaled_image = image_processing.convert_image_to_grayscale(image=image_processing.upload_image(image=self.image))
+        return image_processing.download_image(image=self.thresholder.apply_threshold(image=grayscaled_image))
\ No newline at end of file
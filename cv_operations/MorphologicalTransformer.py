@@ -4,7 +4,10 @@ from enum import StrEnum, auto
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
@@ -15,22 +18,77 @@ class MorphologicalOperation(StrEnum):
     OPENING = auto()
     CLOSING = auto()
 
+# the kernels below don't depend on the image, they are created once when the module is loaded
+DEFAULT_KERNEL = image_processing.Kernel(shape=image_processing.KernelShape.RECTANGLE, dimensions=(3,3))
+CROSS_KERNEL = image_processing.Kernel(shape=image_processing.KernelShape.CROSS, dimensions=(3,3))
+
 @dataclass
 class MorphologicalTransformer:
+    '''
+    Applies a morphological operation to an image.
+    - image: the mathematical representation of the image to transform
+    - operation: the morphological operation to apply
+    - kernel: the Kernel object used for the operation, defaulted to a 3,3 rectangle
+    - nbr_iterations: the number of times the operation is applied
+    - use_fft: if True, the operation is computed in the frequency domain, which is only valid for binary images with one channel.
+    OpenCV direct morphology stays faster up to very large kernels (an ellipse closing of a 2000x1500 image only gets faster with the FFT around 101,101),
+    so it is never selected automatically
+    - fast_approx: if True, an ellipse kernel is approximated by iterating a 3,3 cross kernel, which is much faster for large kernels.
+    The resulting shape is a diamond rather than a disk, so inner corners are less rounded than with the exact ellipse.
+    '''
     image: image_processing.Image
     operation: MorphologicalOperation
-    kernel: image_processing.Kernel =  field(
-        default_factory= lambda: image_processing.Kernel(shape=image_processing.KernelShape.RECTANGLE, dimensions=(3,3)))
+    kernel: image_processing.Kernel = field(default_factory= lambda: DEFAULT_KERNEL)
     nbr_iterations: int = 1
+    use_fft: bool = False
+    fast_approx: bool = False
+
+    def apply(self, dst:image_processing.Image | None = None) -> image_processing.Image:
+        '''
+        Applies the operation and returns the transformed image.
+        - dst: (Optional) the image the result is written into, it can be the image to transform itself when it is only an intermediate.
+        The FFT based morphology always returns a new image
+        '''
+        if self.use_iterated_cross_kernel():
+            kernel, nbr_iterations = self.get_iterated_cross_kernel()
+        elif self.use_fft_morphology():
+            return self.apply_fft()
+        else:
+            kernel, nbr_iterations = self.kernel, self.nbr_iterations
+        match self.operation:
+            case MorphologicalOperation.DILATION:
+                transformed_image = image_processing.dilate(image=self.image, kernel=kernel, nbr_iterations=nbr_iterations, dst=dst)
+            case MorphologicalOperation.EROSION:
+                transformed_image = image_processing.erode(image=self.image, kernel=kernel, nbr_iterations=nbr_iterations, dst=dst)
+            case MorphologicalOperation.OPENING:
+                transformed_image = image_processing.open(image=self.image, kernel=kernel, nbr_iterations=nbr_iterations, dst=dst)
+            case MorphologicalOperation.CLOSING:
+                transformed_image = image_processing.close(image=self.image, kernel=kernel, nbr_iterations=nbr_iterations, dst=dst)
+        return transformed_image
+
+    def use_iterated_cross_kernel(self) -> bool:
+        return self.fast_approx and self.kernel.shape == image_processing.KernelShape.ELLIPSE and max(self.kernel.dimensions) > 3
+
+    def get_iterated_cross_kernel(self) -> tuple[image_processing.Kernel, int]:
+        '''
+        Returns the 3,3 cross kernel and the number of iterations which approximate the ellipse kernel:
+        each iteration grows the shape by one pixel, so a kernel of size K is reached after K // 2 iterations.
+        '''
+        return CROSS_KERNEL, self.nbr_iterations * (max(self.kernel.dimensions) // 2)
+
+    def use_fft_morphology(self) -> bool:
+        if self.use_fft and self.image.ndim != 2:
+            raise ValueError("FFT based morphology is only valid for binary images with one channel")
+        return self.use_fft
 
-    def apply(self) -> image_processing.Image:
+    def apply_fft(self) -> image_processing.Image:
         match self.operation:
             case MorphologicalOperation.DILATION:
-                transformed_image = image_processing.dilate(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
+                transformed_image = image_processing.fft_dilate(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
             case MorphologicalOperation.EROSION:
-                transformed_image = image_processing.erode(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
+                transformed_image = image_processing.fft_erode(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
             case MorphologicalOperation.OPENING:
-                transformed_image = image_processing.open(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
+                transformed_image = image_processing.fft_open(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
             case MorphologicalOperation.CLOSING:
-                transformed_image = image_processing.close(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
+                transformed_image = image_processing.fft_close(image=self.image, kernel=self.kernel, nbr_iterations=self.nbr_iterations)
         return transformed_image
@@ -1,65 +1,149 @@
 from dataclasses import dataclass
-from enum import StrEnum, auto, Enum
+from enum import IntEnum, Enum
 from pathlib import Path
+from functools import lru_cache
+from collections.abc import Mapping
 
 import cv2
 import numpy as np
 
 type Image = np.ndarray
 
-class KernelShape(StrEnum):
-    RECTANGLE = auto()
-    ELLIPSE = auto()
-    CROSS = auto()
+### OPENCV SETTINGS
 
-@dataclass
+def set_opencv_threads(nbr_threads:int) -> None:
+    '''
+    Sets the number of threads used internally by OpenCV for the current process.
+    - nbr_threads: the number of threads, 1 disables OpenCV internal parallelism
+    '''
+    cv2.setNumThreads(nbr_threads)
+
+def is_opencl_available() -> bool:
+    return cv2.ocl.haveOpenCL()
+
+# OpenCV functions accept UMat objects transparently: the operations chained on an uploaded image run through OpenCL,
+# and the data is only transferred back to the host once the result is downloaded
+def upload_image(image:Image) -> cv2.UMat:
+    return cv2.UMat(image)
+
+def download_image(image:cv2.UMat) -> Image:
+    return image.get()
+
+
+class KernelShape(IntEnum):
+    '''
+    Contains the accepted kernel shapes. The values are the OpenCV shapes, so they can be passed to OpenCV directly.
+    '''
+    RECTANGLE = cv2.MORPH_RECT
+    ELLIPSE = cv2.MORPH_ELLIPSE
+    CROSS = cv2.MORPH_CROSS
+
+@dataclass(frozen=True)
 class Kernel:
     '''
     Generates the kernel to be used for morphological operations.
 
     shape: the shape of the kernel we want to apply, accepted values are rectangle, cross or ellipse,\n
-    dimensions: the dimensions of the kernel
+    dimensions: the dimensions of the kernel,\n
+    anchor: (Optional) the (x,y) position of the kernel pixel aligned with the pixel being transformed, defaulted to the kernel center
     '''
     shape: KernelShape
     dimensions: tuple[int, int]
+    anchor: tuple[int, int] | None = None
 
     # more info on how the kernel get calculated can be found here: https://docs.opencv.org/4.x/d9/d61/tutorial_py_morphological_ops.html
-    def generate(self):
-        match self.shape:
-            case KernelShape.RECTANGLE:
-                shape_opencv = cv2.MORPH_RECT
-            case KernelShape.CROSS:
-                shape_opencv = cv2.MORPH_CROSS
-            case KernelShape.ELLIPSE:
-                shape_opencv = cv2.MORPH_ELLIPSE
-        return cv2.getStructuringElement(shape=shape_opencv, ksize=self.dimensions)
+    def generate(self) -> np.ndarray:
+        return _generate_structuring_element(shape=self.shape, dimensions=tuple(self.dimensions))
+
+    def get_anchor(self) -> tuple[int, int]:
+        if self.anchor is None:
+            return self.dimensions[0] // 2, self.dimensions[1] // 2
+        return self.anchor
+
+    def scale(self, factor:float) -> "Kernel":
+        '''
+        Returns the kernel covering the same area once the image is resized by the factor provided, it is never smaller than 1 px.
+        - factor: the factor applied to the image dimensions, e.g. 0.5 for an image downscaled by half
+        '''
+        width, height = max(1, round(self.dimensions[0] * factor)), max(1, round(self.dimensions[1] * factor))
+        anchor = None if self.anchor is None else (min(width - 1, round(self.anchor[0] * factor)), min(height - 1, round(self.anchor[1] * factor)))
+        return Kernel(shape=self.shape, dimensions=(width, height), anchor=anchor)
+
+    def generate_iterated(self, nbr_iterations:int) -> np.ndarray:
+        '''
+        Generates the single structuring element equivalent to several iterations of the kernel, anchored at nbr_iterations times the kernel anchor.
+        - nbr_iterations: the number of times the kernel would have been applied
+        '''
+        return _generate_iterated_structuring_element(shape=self.shape, dimensions=tuple(self.dimensions), nbr_iterations=nbr_iterations)
+
+# the same kernels are used for every image, so each structuring element is only built once
+# the array is shared between all the calls, so it should never be modified in place
+@lru_cache(maxsize=64)
+def _generate_structuring_element(shape:KernelShape, dimensions:tuple[int, int]) -> np.ndarray:
+    return cv2.getStructuringElement(shape=shape.value, ksize=dimensions)
+
+# dilating n times by an element is dilating once by the element summed n times with itself (Minkowski sum)
+@lru_cache(maxsize=64)
+def _generate_iterated_structuring_element(shape:KernelShape, dimensions:tuple[int, int], nbr_iterations:int) -> np.ndarray:
+    element = _generate_structuring_element(shape=shape, dimensions=dimensions)
+    element_height, element_width = element.shape
+    offsets = np.argwhere(element)
+    iterated_element = element
+    for _ in range(nbr_iterations - 1):
+        iterated_height, iterated_width = iterated_element.shape
+        grown_element = np.zeros((iterated_height + element_height - 1, iterated_width + element_width - 1), dtype=np.uint8)
+        for y, x in offsets:
+            grown_element[y:y + iterated_height, x:x + iterated_width] |= iterated_element
+        iterated_element = grown_element
+    return iterated_element
 
 
 # .inRange associates any pixel with values lying in the range [lower_b, upper_b] to 255 (white), and the others 0
-def create_mask(image:Image, boundaries: tuple[list[int], list[int]]) -> np.ndarray:
-    return cv2.inRange(src=image, lowerb=np.array(boundaries[0]), upperb=np.array(boundaries[1]))
+def create_mask(image:Image, boundaries: tuple[list[int], list[int]], dst:np.ndarray | None = None) -> np.ndarray:
+    return cv2.inRange(src=image, lowerb=np.asarray(boundaries[0], dtype=np.uint8), upperb=np.asarray(boundaries[1], dtype=np.uint8), dst=dst)
 
 
 ### IMAGES CONVERSION TO OTHER COLOR MODES
 
-def convert_image_to_hsv(image:Image) -> Image:
-    return cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+def convert_image_to_hsv(image:Image, dst:Image | None = None) -> Image:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=dst)
 
 def convert_image_from_gray_to_color(image:Image) -> Image:
     return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
-def convert_image_to_grayscale(image: Image) -> Image:
+def convert_image_from_bgr_to_rgb(image:Image, in_place: bool = False) -> Image:
+    '''
+    Swaps the blue and red channels of the image.
+    - image: the mathematical representation of the BGR image
+    - in_place: if True, the pixels of the image provided are overwritten instead of allocating a new image
+    '''
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image if in_place else None)
+
+def convert_color_from_rgb_to_hsv(color:tuple[int,int,int]) -> tuple[int,int,int]:
+    '''
+    Converts a single RGB color to the HSV representation used by OpenCV (hue between 0 and 180, saturation and value between 0 and 255)
+    - color: the (R,G,B) values of the color, each between 0 and 255
+    '''
+    # the color is treated as a 1x1 image, so the conversion matches the one applied on the images we filter
+    h, s, v = cv2.cvtColor(np.array([[color]], dtype=np.uint8), cv2.COLOR_RGB2HSV)[0, 0]
+    return int(h), int(s), int(v)
+
+def convert_image_to_grayscale(image: Image, dst: Image | None = None) -> Image:
     '''
     Changes the pixels representation for a given image from 3 dimensions (e.g. RGB) to 1 dimension (shades of grey, 255 being white and 0 black)
-    - image: the mathematical representation of a colored image
+    - image: the mathematical representation of a colored image, an image already grayscaled is returned as is
+    - dst: (Optional) a preallocated single channel image of the same size, reused to store the result instead of allocating a new image
     '''
-    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if isinstance(image, np.ndarray) and image.ndim == 2:
+        return image
+    # OpenCV dispatches cvtColor at runtime to the widest SIMD instruction set available (SSE/AVX2/NEON)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
 
 ### IMAGE THRESHOLDING
 
 # Global thresholding methods
 
-def apply_simple_binary_threshold(image: Image, threshold_value: float = 127, new_pixel_value: float = 255, inversion: bool = False) -> Image:
+def apply_simple_binary_threshold(image: Image, threshold_value: float = 127, new_pixel_value: float = 255, inversion: bool = False, dst: Image | None = None) -> Image:
     '''
     Apply a simple binary threshold to the image pixel values. By default, turns every pixel above the mid range grey white.
 
@@ -67,9 +151,10 @@ def apply_simple_binary_threshold(image: Image, threshold_value: float = 127, ne
     - threshold_value: value used for the pixel_value > threshold_value comparison, \n
     - new_pixel_value: the non null pixel value which pixels will take depending on the threshold comparisons results, \n
     - inversion: if False, new_pixel_value is assigned to pixels whose value is above the threshold, if True pixels above the threshold take the value 0 (black pixel)
+    - dst: (Optional) the array where the result is written, it can be the image itself
     '''
     threshold_type = cv2.THRESH_BINARY_INV if inversion else cv2.THRESH_BINARY
-    return cv2.threshold(src=image, thresh=threshold_value, maxval=new_pixel_value, type=threshold_type)[1]
+    return cv2.threshold(src=image, thresh=threshold_value, maxval=new_pixel_value, type=threshold_type, dst=dst)[1]
 
 def apply_simple_truncation_threshold(image: Image, threshold_value: float = 127) -> Image:
     '''
@@ -81,7 +166,7 @@ def apply_simple_truncation_threshold(image: Image, threshold_value: float = 127
     '''
     return cv2.threshold(src=image, thresh=threshold_value, maxval=255, type=cv2.THRESH_TRUNC)[1]
 
-def apply_complex_binary_threshold(image: Image, new_pixel_value: int = 255, inversion: bool = False) -> Image:
+def apply_complex_binary_threshold(image: Image, new_pixel_value: int = 255, inversion: bool = False, dst: Image | None = None) -> Image:
     '''
     Changes the pixels representation of a grayscaled image to a binary representation (either black with 0 or white with 255) 
     based on an optimal threshold calculated via Otsu optimization method
@@ -89,10 +174,11 @@ def apply_complex_binary_threshold(image: Image, new_pixel_value: int = 255, inv
     - image: the mathematical representation of the grayscaled version of an image, \n
     - new_pixel_value: the non null pixel value which pixels will take depending on the threshold comparisons results \n
     - inversion: if False, new_pixel_value is assigned to pixels whose value is above the threshold, if True pixels above the threshold take the value 0 (black pixel)
+    - dst: (Optional) the array where the result is written, it can be the image itself
     '''
     threshold_type = cv2.THRESH_BINARY_INV if inversion else cv2.THRESH_BINARY
     # threshold will be computed via Otsu method, so the value provided is arbitrary
-    return cv2.threshold(src=image, thresh=0, maxval=new_pixel_value, type=threshold_type + cv2.THRESH_OTSU)[1]
+    return cv2.threshold(src=image, thresh=0, maxval=new_pixel_value, type=threshold_type + cv2.THRESH_OTSU, dst=dst)[1]
 
 # Adaptive thresholding methods
 
@@ -116,7 +202,7 @@ class AdaptiveThresholdMethod:
     neighboor_matrix_size: int
     constant: int
 
-def apply_adaptive_threshold(image: Image, method: AdaptiveThresholdMethod, new_pixel_value: float = 255, inversion: bool = False) -> Image:
+def apply_adaptive_threshold(image: Image, method: AdaptiveThresholdMethod, new_pixel_value: float = 255, inversion: bool = False, dst: Image | None = None) -> Image:
     '''
     Apply an adaptive method to threshold the image pixel values, where thresholds are calculated for each pixel based on its neighbors pixel values: 
     it is useful when the lighting conditions / shadowing vary in the picture.
@@ -125,30 +211,35 @@ def apply_adaptive_threshold(image: Image, method: AdaptiveThresholdMethod, new_
     - method: the adaptive method used to compute the threshold, \n
     - new_pixel_value: the non null pixel value which pixels will take depending on the threshold comparisons results \n
     - inversion: if False, new_pixel_value is assigned to pixels whose value is above the threshold, if True pixels above the threshold take the value 0 (black pixel)
+    - dst: (Optional) the array where the result is written, it can be the image itself
     '''
     threshold_type = cv2.THRESH_BINARY_INV if inversion else cv2.THRESH_BINARY
-    return cv2.adaptiveThreshold(src=image, maxValue=new_pixel_value, thresholdType=threshold_type, adaptiveMethod=method.method.value, blockSize=method.neighboor_matrix_size, C=method.constant)
+    return cv2.adaptiveThreshold(src=image, maxValue=new_pixel_value, thresholdType=threshold_type, adaptiveMethod=method.method.value, blockSize=method.neighboor_matrix_size, C=method.constant, dst=dst)
 
 
 ### IMAGE OPERATIONS 
 
-def add_images(image1:Image, image2:Image) -> Image:
-    return cv2.add(src1=image1, src2=image2)
+def add_images(image1:Image, image2:Image, dst:Image | None = None) -> Image:
+    return cv2.add(src1=image1, src2=image2, dst=dst)
 
-def substract_images(image1:Image, image2:Image) -> Image:
-    return cv2.subtract(src1=image1, src2=image2)
+def substract_images(image1:Image, image2:Image, dst:Image | None = None) -> Image:
+    return cv2.subtract(src1=image1, src2=image2, dst=dst)
 
-def invert_image(image: Image):
+def invert_image(image: Image, in_place: bool = False):
     '''
     Inverts the color distribution of black and white images (black pixels become white and respectively)
 
     - image: thresholded version of the image we analyze
+    - in_place: if True, the pixels of the image provided are overwritten instead of allocating a new image
     '''
-    return cv2.bitwise_not(image)
+    return cv2.bitwise_not(image, dst=image if in_place else None)
 
 def apply_bitwise_and(image1:Image, image2:Image, mask:np.ndarray):
     return cv2.bitwise_and(src1=image1, src2=image2, mask=mask)
 
+def apply_bitwise_or(image1:Image, image2:Image, dst:Image | None = None) -> Image:
+    return cv2.bitwise_or(src1=image1, src2=image2, dst=dst)
+
 def add_padding(image:Image, percentage:int, color: list[int,int,int] = [255, 255, 255]) -> Image:
     '''
     Adds a regular padding to the image, by default the padding color is white
@@ -162,6 +253,35 @@ def add_padding(image:Image, percentage:int, color: list[int,int,int] = [255, 25
     horizontal_padding = int(image_width * (percentage/100))
     return cv2.copyMakeBorder(src=image, top=vertical_padding, bottom=vertical_padding, left=horizontal_padding, right=horizontal_padding, borderType=cv2.BORDER_CONSTANT, value=color)
 
+def stack_images_vertically(images:list[Image], separator_height:int, color: list[int,int,int] = [255, 255, 255]) -> tuple[Image, list[int]]:
+    '''
+    Stacks the images on top of each other, left aligned, and returns the stacked image along with the y coordinate where each image starts.
+    - images: the mathematical representations of the colored images to stack, in the order they should appear from top to bottom
+    - separator_height: the height in px of the band separating two consecutive images
+    - color: the BGR color of the pixels used for the separators and to pad the narrower images, as a list
+    '''
+    stacked_width = max(image.shape[1] for image in images)
+    stacked_height = sum(image.shape[0] for image in images) + separator_height * (len(images) - 1)
+    stacked_image = np.full((stacked_height, stacked_width, 3), color, dtype=np.uint8)
+    start_y_values = []
+    y = 0
+    for image in images:
+        stacked_image[y:y + image.shape[0], :image.shape[1]] = image
+        start_y_values.append(y)
+        y += image.shape[0] + separator_height
+    return stacked_image, start_y_values
+
+def scale_image(image:Image, scale:float) -> Image:
+    '''
+    Resizes the image by the same factor along both axis.
+    - image: the mathematical representation of the image we want to resize
+    - scale: the factor applied to the image dimensions, e.g. 0.5 to divide them by 2
+    '''
+    if scale == 1:
+        return image
+    # area interpolation averages the pixels when downscaling, which avoids aliasing on thin lines
+    return cv2.resize(src=image, dsize=None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
 def crop_image(image:Image, height_boundaries:tuple[int,int], width_boundaries:tuple[int,int]) -> Image:
     '''
     Returns the part of the image contained in the square formed by the x and y boundaries
@@ -176,35 +296,75 @@ def apply_perspective_transformation(image:Image, table_corner_edges:list[tuple[
     '''
     Applies perspective transformation to an image to straigthen the lines on it.
     - image: the mathematical representation of the image we want to apply perspective transformation
-    - table_corner_edges: a list containing the coordinates (x,y) of each corner points of the main table in the image, in a clockwise order starting from top left
+    - table_corner_edges: a list containing the coordinates (x,y) of each corner points of the main table in the image, in a clockwise order starting from top left.
+    It is read as a (4,2) array.
     - final_image_dimensions: the (width, height) of the new image computed
     '''
     final_width = final_image_dimensions[0]
     final_height = final_image_dimensions[1]
-    pts1 = np.float32([[table_corner_edges[i][0], table_corner_edges[i][1]] for i in range(len(table_corner_edges))])
-    pts2 = np.float32([[0, 0], [final_width, 0], [final_width, final_height], [0, final_height]])
+    pts1 = np.asarray(table_corner_edges, dtype=np.float32).reshape(4, 2)
+    pts2 = np.array([[0, 0], [final_width, 0], [final_width, final_height], [0, final_height]], dtype=np.float32)
     transformation_matrix = cv2.getPerspectiveTransform(pts1, pts2)
     return cv2.warpPerspective(src=image, M=transformation_matrix, dsize=(final_width, final_height))
 
 
 ### MORPHOLOGICAL OPERATIONS
 
-def close(image:Image, kernel:Kernel, nbr_iterations:int) -> Image:
-    return cv2.morphologyEx(src=image, op=cv2.MORPH_CLOSE, kernel=kernel.generate(), iterations=nbr_iterations)
+# the morphological operations can be written into an existing image with dst, including the source image itself
+def close(image:Image, kernel:Kernel, nbr_iterations:int, dst:Image | None = None) -> Image:
+    return cv2.morphologyEx(src=image, op=cv2.MORPH_CLOSE, kernel=kernel.generate(), anchor=kernel.get_anchor(), iterations=nbr_iterations, dst=dst)
+
+def open(image:Image, kernel:Kernel, nbr_iterations:int, dst:Image | None = None) -> Image:
+    return cv2.morphologyEx(src=image, op=cv2.MORPH_OPEN, kernel=kernel.generate(), anchor=kernel.get_anchor(), iterations=nbr_iterations, dst=dst)
 
-def open(image:Image, kernel:Kernel, nbr_iterations:int) -> Image:
-    return cv2.morphologyEx(src=image, op=cv2.MORPH_OPEN, kernel=kernel.generate(), iterations=nbr_iterations)
+def dilate(image: Image, kernel:Kernel, nbr_iterations:int, dst:Image | None = None) -> Image:
+    return cv2.dilate(src=image, kernel=kernel.generate(), anchor=kernel.get_anchor(), iterations=nbr_iterations, dst=dst)
 
-def dilate(image: Image, kernel:Kernel, nbr_iterations:int) -> Image:
-    return cv2.dilate(src=image, kernel=kernel.generate(), iterations=nbr_iterations)
+def erode(image: Image, kernel:Kernel, nbr_iterations:int, dst:Image | None = None) -> Image:
+    return cv2.erode(src=image, kernel=kernel.generate(), anchor=kernel.get_anchor(), iterations=nbr_iterations, dst=dst)
 
-def erode(image: Image, kernel:Kernel, nbr_iterations:int) -> Image:
-    return cv2.erode(src=image, kernel=kernel.generate(), iterations=nbr_iterations)
+# FFT based morphology, only valid for binary images (0 and 255 pixel values)
+# for large non separable kernels, a dilation is a convolution of the image with the kernel followed by a threshold,
+# which costs O(N log N) instead of O(N * K²). More info here: https://en.wikipedia.org/wiki/Dilation_(morphology)
+
+def fft_dilate(image: Image, kernel:Kernel, nbr_iterations:int) -> Image:
+    '''
+    Dilates a binary image by computing the correlation between the image and the kernel in the frequency domain.
+    - image: the mathematical representation of a binary image, with one channel only
+    - kernel: the kernel used for the dilation, it is anchored like in OpenCV
+    - nbr_iterations: the number of times the dilation is applied
+    '''
+    # the iterations are merged into a single larger element, so the image goes through the FFT only once
+    kernel_array = kernel.generate_iterated(nbr_iterations=nbr_iterations)
+    kernel_height, kernel_width = kernel_array.shape
+    image_height, image_width = image.shape
+    # the transforms are padded to sizes OpenCV knows to be fast (products of 2, 3 and 5), the extra zeros don't change the correlation
+    fft_shape = (cv2.getOptimalDFTSize(image_height + kernel_height - 1), cv2.getOptimalDFTSize(image_width + kernel_width - 1))
+    kernel_fft = np.fft.rfft2(kernel_array[::-1, ::-1].astype(np.float32), s=fft_shape)
+    # offsets of the correlation result within the full convolution, the anchor of the iterated element is the sum of the kernel anchors
+    anchor_x, anchor_y = kernel.get_anchor()
+    anchor_height, anchor_width = nbr_iterations * anchor_y, nbr_iterations * anchor_x
+    top = kernel_height - 1 - anchor_height
+    left = kernel_width - 1 - anchor_width
+    image_fft = np.fft.rfft2((image > 0).astype(np.float32), s=fft_shape)
+    correlation = np.fft.irfft2(image_fft * kernel_fft, s=fft_shape)[top:top + image_height, left:left + image_width]
+    # any kernel pixel overlapping a white pixel turns the pixel white, 0.5 absorbs the FFT rounding errors
+    return np.where(correlation > 0.5, 255, 0).astype(np.uint8)
+
+def fft_erode(image: Image, kernel:Kernel, nbr_iterations:int) -> Image:
+    # erosion is the dual of dilation: eroding the white pixels is dilating the black ones
+    return invert_image(image=fft_dilate(image=invert_image(image=image), kernel=kernel, nbr_iterations=nbr_iterations), in_place=True)
+
+def fft_close(image: Image, kernel:Kernel, nbr_iterations:int) -> Image:
+    return fft_erode(image=fft_dilate(image=image, kernel=kernel, nbr_iterations=nbr_iterations), kernel=kernel, nbr_iterations=nbr_iterations)
+
+def fft_open(image: Image, kernel:Kernel, nbr_iterations:int) -> Image:
+    return fft_dilate(image=fft_erode(image=image, kernel=kernel, nbr_iterations=nbr_iterations), kernel=kernel, nbr_iterations=nbr_iterations)
 
 
 ### CONTOUR OPERATIONS
 
-def get_contours(image:Image, collectHierarchy: bool = False ,useApproximation: bool = True) -> list[np.ndarray]:
+def get_contours(image:Image, collectHierarchy: bool = False ,useApproximation: bool = True, onlyExternal: bool = False) -> list[np.ndarray]:
     '''
     Get list of all contours detected in the image.
 
@@ -212,9 +372,13 @@ def get_contours(image:Image, collectHierarchy: bool = False ,useApproximation:
     Contours to detect need to be represented by white pixels, the image background by back pixels.
     - useApproximation: defines whether we want to approximate contours to its edges or not. If what is to be detected is composed of 
     lines, useApproximation should use the defaulted value for memory optimization.
+    - onlyExternal: if True, only the outer contours of the white areas are detected, the contours of the holes inside them are skipped
     '''
     computation_method = cv2.CHAIN_APPROX_SIMPLE if useApproximation else cv2.CHAIN_APPROX_NONE
-    hierarchy_mode = cv2.RETR_TREE if collectHierarchy else cv2.RETR_LIST
+    if onlyExternal:
+        hierarchy_mode = cv2.RETR_EXTERNAL
+    else:
+        hierarchy_mode = cv2.RETR_TREE if collectHierarchy else cv2.RETR_LIST
     contours, hierarchy = cv2.findContours(image=image, mode=hierarchy_mode, method=computation_method)
     return contours
         
@@ -236,13 +400,16 @@ def get_contour_perimeter(contour:np.ndarray, isContourClosed: bool) -> float:
 def get_contour_area(contour:np.ndarray) -> float:
     return cv2.contourArea(contour=contour)
 
-def get_contour_approximation(contour:np.ndarray, eps: float, isContourClosed) -> np.ndarray:
+def get_contour_approximation(contour:np.ndarray, eps: float, isContourClosed, perimeter: float | None = None) -> np.ndarray:
     '''
     Gets an approximation of the shape of the contour, to account for image noise.
     - contour: the mathematical representation of a shape contour, which is an array of (x,y) coordinates
     - eps: percentage of the perimeter of the contour we use for the approximation
+    - perimeter: (Optional) the perimeter of the contour, see get_contour_perimeter. When it was already computed, it avoids measuring the contour again.
     '''
-    epsilon = eps*cv2.arcLength(curve=contour,closed=isContourClosed)
+    if perimeter is None:
+        perimeter = get_contour_perimeter(contour=contour, isContourClosed=isContourClosed)
+    epsilon = eps*perimeter
     return cv2.approxPolyDP(curve=contour,epsilon=epsilon,closed=isContourClosed)
 
 def get_bounding_box(contour:np.ndarray) -> tuple[int,int,int,int]:
@@ -253,6 +420,21 @@ def get_bounding_box(contour:np.ndarray) -> tuple[int,int,int,int]:
     '''
     x, y, w, h = cv2.boundingRect(contour)
     return x, y, w, h 
+
+def get_bounding_boxes(contours:list[np.ndarray]) -> np.ndarray:
+    '''
+    Returns the smallest boxes which contain each contour, as a (N,4) array in the same format as get_bounding_box.
+    - contours: the list of the contours, each one being an array of (x,y) coordinates
+    '''
+    if len(contours) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    # the points of all the contours are reduced together, each contour being a segment of the concatenated points
+    points = np.concatenate(contours).reshape(-1, 2)
+    contour_starts = np.cumsum([0] + [len(contour) for contour in contours[:-1]])
+    top_left_corners = np.minimum.reduceat(points, contour_starts)
+    bottom_right_corners = np.maximum.reduceat(points, contour_starts)
+    # the pixels of both corners belong to the box, as with cv2.boundingRect
+    return np.hstack([top_left_corners, bottom_right_corners - top_left_corners + 1]).astype(np.int32)
     
 
 ### ANNOTATION OPERATIONS
@@ -288,8 +470,32 @@ def draw_rectangle(image:Image, top_left_point:tuple[int,int], bottom_right_poin
     '''
     cv2.rectangle(img=image, pt1=top_left_point, pt2=bottom_right_point, color=color, thickness=thickness)
 
+def draw_rectangles(image:Image, boxes:np.ndarray, color:tuple[int,int,int]=(0, 255, 0), thickness:int = 5) -> None:
+    '''
+    Adds all the rectangles of the boxes at once.
+    - image: the mathematical representation of the image we want to annotate
+    - boxes: the rectangles as a (N,4) array, in the format (top-left-corner_x, top-left-corner_y, box_width, box_height)
+    - color: color of the rectangles, defaulted to green
+    - thickness: thickness of the rectangles, defaulted to 5 px
+    '''
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return
+    x, y, w, h = boxes.T
+    # the 4 corners of each rectangle, in drawing order, so every rectangle is drawn as a closed polygon
+    corners = np.stack([
+        np.stack([x, y], axis=1),
+        np.stack([x + w, y], axis=1),
+        np.stack([x + w, y + h], axis=1),
+        np.stack([x, y + h], axis=1)
+    ], axis=1)
+    # a single OpenCV call draws all the polygons, instead of one call per rectangle
+    cv2.polylines(img=image, pts=list(corners), isClosed=True, color=color, thickness=thickness)
+
 ### READING AND STORING IMAGES
 
+DEBUG_JPEG_QUALITY = 85
+
 @dataclass
 class ImageHandler:
     '''
@@ -298,28 +504,35 @@ class ImageHandler:
     '''
     image_path: str
 
-    def load_image(self) -> Image:
+    def load_image(self, grayscale: bool = False) -> Image:
         '''
         Loads the image stored at the path given
+        - grayscale: (Optional) if True, the image is decoded directly with a single channel, e.g. for binary images
         '''
         img_path = Path(self.image_path) 
-        return self._read_image(image_path=img_path)
+        return self._read_image(image_path=img_path, grayscale=grayscale)
 
-    def _read_image(self, image_path:Path) -> Image:
-        return cv2.imread(filename=str(image_path.resolve())) #OpenCV cannot handle Path objects, it expects strings
+    def _read_image(self, image_path:Path, grayscale: bool = False) -> Image:
+        flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+        return cv2.imread(filename=str(image_path.resolve()), flags=flags) #OpenCV cannot handle Path objects, it expects strings
 
-    def store_image(self, folder_path:str, file_name:str, image:Image) -> Path:
+    def store_image(self, folder_path:str, file_name:str, image:Image, jpeg_quality:int = 95) -> str:
         '''
         Stores locally the image provided and returns its path.
         - folder_path: the path to the folder where the image should be stored
         - file_name: the name of the image file, along with its extension (.jpg or .png)
         - image: the image to save
+        - jpeg_quality: (Optional) the quality of JPEG images, from 0 to 100, defaulted to OpenCV default value
         '''
         path = Path(folder_path + self.get_image_name() + "_" + file_name)
-        cv2.imwrite(filename=str(path.resolve()), img=image) #OpenCV cannot handle Path objects, it expects strings
-        return str(path.resolve())
-
-    def store_debug_image(self, folder_path:str, state_mapping: dict[str,Image], states:list[str], state:str) -> str:
+        # PNG is lossless, the lowest compression level is enough for binary images and is the fastest to encode
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1] if path.suffix == ".png" else [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        # the path is resolved once, it is both used for writing and returned
+        resolved_path = str(path.resolve())
+        cv2.imwrite(filename=resolved_path, img=image, params=params) #OpenCV cannot handle Path objects, it expects strings
+        return resolved_path
+
+    def store_debug_image(self, folder_path:str, state_mapping: Mapping[str,Image | None], states:tuple[str, ...], state:str) -> str:
         '''
         Stores locally an image corresponding to a specific state of the transformation occuring.
         - folder_path: the path to the folder where the image should be stored
@@ -329,8 +542,13 @@ class ImageHandler:
         '''
         if state not in states:
                 raise ValueError(f"The state value provided is not allowed, use one of these values instead: {", ".join(states)}")
+        # the image is looked up once, as some mappings render it on each lookup
+        image = state_mapping[state]
+        if image is None:
+                raise ValueError(f"The state {state} was not computed, the transformation should be run in debug mode")
 
-        path = self.store_image(file_name=f"{state}.jpg", folder_path=folder_path, image=state_mapping[state])
+        # debug images are only looked at, a lower quality makes them faster to encode and lighter
+        path = self.store_image(file_name=f"{state}.jpg", folder_path=folder_path, image=image, jpeg_quality=DEBUG_JPEG_QUALITY)
         return path
     
     def get_image_name(self) -> str:
@@ -15,23 +15,28 @@ DEBUG_FOLDER_PATH = "images/debug/"
 OCR_SLICES_FOLDER_PATH = "images/ocr_slices/"
 COLUMN_NAMES = ["Plat", "Type de vin", "Appelation"]
 
-def extract_table(background_color: tuple[int,int,int], image: Image) -> tuple[TableExtractor,Image]:
+# the app and the batch entrypoint process the same images, they share their folders and colors
+OCR_FINAL_PATH = "outputs"
+TABLE_INPUT_PATH = "images"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+
+BACKGROUND_COLOR = (163, 151, 152)
+GOLD_ICONS_COLOR = (158, 130, 90)
+RED_ICONS_COLOR = (163, 151, 152)
+
+def extract_table(background_color: tuple[int,int,int], image: Image, debug:bool = False) -> tuple[TableExtractor,Image]:
     # otsu optimized thresholding method showed better results
     # to perform table extraction
     table_extractor = TableExtractor(
         image=image,
         background_color=background_color,
-        thresholder=GlobalOptimizedThresholder()
+        thresholder=GlobalOptimizedThresholder(),
+        debug=debug
     )
     image = table_extractor.run()
     return table_extractor, image 
 
-def remove_icons(icon_colors: list[tuple[int,int,int]], image_path: str) -> tuple[TableIconsRemover,Image]:
-    # we start from the stored image of the previous step to avoid channel conflicts
-    # as the classes were made to work independently based on image input
-    img_handler = ImageHandler(image_path=image_path)
-    image = img_handler.load_image()
-
+def remove_icons(icon_colors: list[tuple[int,int,int]], image: Image) -> tuple[TableIconsRemover,Image]:
     table_icon_remover = TableIconsRemover(
         image=image,
         icon_colors=icon_colors,
@@ -40,12 +45,8 @@ def remove_icons(icon_colors: list[tuple[int,int,int]], image_path: str) -> tupl
     image = table_icon_remover.run()
     return table_icon_remover, image
 
-def remove_lines(image_path: str) -> tuple[TableLinesRemover,Image]:
-    # we start from the stored image of the previous step to avoid channel conflicts
-    # as the classes were made to work independently based on image input
-    img_handler = ImageHandler(image_path=image_path)
-    image = img_handler.load_image()
-
+def remove_lines(image: Image) -> tuple[TableLinesRemover,Image]:
+    # the binary image of the previous step has a single channel, the preprocessing keeps it as is
     table_lines_remover = TableLinesRemover(
         image=image,
         vertical_lines_kernel= Kernel(
@@ -60,32 +61,26 @@ def remove_lines(image_path: str) -> tuple[TableLinesRemover,Image]:
     image = table_lines_remover.run()
     return table_lines_remover, image
 
-def get_bounding_boxes(image_path:str, extracted_table_path:str) -> tuple[TextBoundingBoxExtractor, dict[str,list[BoundingBox]], list[BoundingBox]]:
-    # we start from the stored image of the previous step to avoid channel conflicts
-    # as the classes were made to work independently based on image input
-    img_handler = ImageHandler(image_path=image_path)
-    image = img_handler.load_image()
-    extracted_table_img_handler = ImageHandler(image_path=extracted_table_path)
-    extracted_table_image = img_handler.load_image()
-
+def get_bounding_boxes(image:Image, extracted_table_image:Image) -> tuple[TextBoundingBoxExtractor, dict[int,list[BoundingBox]], list[BoundingBox]]:
+    # the final bounding boxes are stored as a debug image, displayed in the app
     bounding_box_extractor = TextBoundingBoxExtractor(
         image=image,
-        original_image=extracted_table_image
+        original_image=extracted_table_image,
+        debug=True
     )
     table_columns, bounding_boxes = bounding_box_extractor.run()
     return bounding_box_extractor, table_columns, bounding_boxes
 
-def perform_ocr(bounding_box_array:list, extracted_table_path:str, initial_img_path:str, slices_folder:str) -> list[list[str]]:
-    img_handler = ImageHandler(image_path=extracted_table_path)
-    image = img_handler.load_image()
-
+def perform_ocr(bounding_box_array:list, image:Image, initial_img_path:str, slices_folder:str, store_slices:bool = False, max_workers:int | None = None) -> list[list[str]]:
     ocr_processor = OrcProcessor(
         table_bounding_box_array=bounding_box_array,
         image=image,
         original_image_path=initial_img_path,
         images_folder_path=slices_folder,
         table_column_names=["meal_name", "wine_types", "wine_appelations"],
-        language=TesseractLanguage.FRENCH
+        language=TesseractLanguage.FRENCH,
+        store_slices=store_slices,
+        max_workers=max_workers
     )
     return ocr_processor.run()
 
@@ -97,7 +92,7 @@ class TransformationProcessor(Protocol):
     def get_transformation_states_mapping(self) -> dict[StrEnum,Image]:
         ...
     
-    def get_transformation_states(self) -> list[str]:
+    def get_transformation_states(self) -> tuple[str, ...]:
         ...
 
 
@@ -110,37 +105,49 @@ def debug_transformation_process(processor:TransformationProcessor, img_handler:
         )
 
 ### Execute
-def retrieve_csv(image_path:str, background_color:str, icons_colors:list[tuple[int,int,int]]) -> None:
+def retrieve_csv(image_path:str, background_color:str, icons_colors:list[tuple[int,int,int]], ocr_max_workers:int | None = None, debug:bool = False) -> None:
+    '''
+    Extracts the table from the image and stores its content as a csv file.
+    The intermediate images shown in the app are always stored, the other transformation states only in debug mode.
+    The images are passed from one step to the next in memory, the stored images are never read back.
+    '''
     # initialize the image handler
     img_handler = ImageHandler(image_path=image_path)
     image = img_handler.load_image()
 
     # table extraction
-    extractor, image_with_extracted_table = extract_table(background_color=background_color, image=image)
+    extractor, image_with_extracted_table = extract_table(background_color=background_color, image=image, debug=debug)
     extracted_table_path = img_handler.store_image(folder_path=DEBUG_FOLDER_PATH, file_name="extracted_table.jpg", image=image_with_extracted_table)
-    # available values are TableExtractionState enums
-    extraction_step_debug_path = debug_transformation_process(
-        processor=extractor, 
-        img_handler=img_handler, 
-        state=TableExtractionState.TABLE_EDGES)
-    print("Extraction Completed: \nfinal img: " + extracted_table_path + "\ndebug img: " + extraction_step_debug_path + "\n")
+    print("Extraction Completed: \nfinal img: " + extracted_table_path + "\n")
+    if debug:
+        # available values are TableExtractionState enums
+        extraction_step_debug_path = debug_transformation_process(
+            processor=extractor, 
+            img_handler=img_handler, 
+            state=TableExtractionState.TABLE_EDGES)
+        print("debug img: " + extraction_step_debug_path + "\n")
 
     # icons removal
-    icon_remover, image_without_icons = remove_icons(icon_colors=icons_colors, image_path=extracted_table_path)
-    removed_icons_path = img_handler.store_image(folder_path=DEBUG_FOLDER_PATH, file_name="without_icons.jpg", image=image_without_icons)
-    # available values are IconRemovingState enums
-    ic_removal_step_debug_path = debug_transformation_process(processor=icon_remover, img_handler=img_handler, state=IconRemovingState.ICONS_FILTERING)
-    print("Icons Removal Completed: \nfinal img: " + removed_icons_path + "\ndebug img: " + ic_removal_step_debug_path + "\n")
+    icon_remover, image_without_icons = remove_icons(icon_colors=icons_colors, image=image_with_extracted_table)
+    # binary images are stored losslessly, so the app shows exactly the pixels computed
+    removed_icons_path = img_handler.store_image(folder_path=DEBUG_FOLDER_PATH, file_name="without_icons.png", image=image_without_icons)
+    print("Icons Removal Completed: \nfinal img: " + removed_icons_path + "\n")
+    if debug:
+        # available values are IconRemovingState enums
+        ic_removal_step_debug_path = debug_transformation_process(processor=icon_remover, img_handler=img_handler, state=IconRemovingState.ICONS_FILTERING)
+        print("debug img: " + ic_removal_step_debug_path + "\n")
     
     # lines removal
-    line_remover, image_without_lines = remove_lines(image_path=removed_icons_path)
-    removed_lines_path = img_handler.store_image(folder_path=DEBUG_FOLDER_PATH, file_name="without_lines.jpg", image=image_without_lines)
-    # available values are LinesRemovingState enums
-    ln_removal_step_debug_path = debug_transformation_process(processor=line_remover, img_handler=img_handler, state=LinesRemovingState.ALL_LINES_DILATION)
-    print("Lines Removal Completed: \nfinal img: " + removed_lines_path + "\ndebug img: " + ln_removal_step_debug_path + "\n")
+    line_remover, image_without_lines = remove_lines(image=image_without_icons)
+    removed_lines_path = img_handler.store_image(folder_path=DEBUG_FOLDER_PATH, file_name="without_lines.png", image=image_without_lines)
+    print("Lines Removal Completed: \nfinal img: " + removed_lines_path + "\n")
+    if debug:
+        # available values are LinesRemovingState enums
+        ln_removal_step_debug_path = debug_transformation_process(processor=line_remover, img_handler=img_handler, state=LinesRemovingState.ALL_LINES_DILATION)
+        print("debug img: " + ln_removal_step_debug_path + "\n")
 
     # text bounding boxes extraction
-    bounding_box_extractor, table_columns, bounding_boxes = get_bounding_boxes(image_path=removed_lines_path, extracted_table_path=extracted_table_path)
+    bounding_box_extractor, table_columns, bounding_boxes = get_bounding_boxes(image=image_without_lines, extracted_table_image=image_with_extracted_table)
     # available values are LinesRemovingState enums
     bbox_extraction_step_debug_path = debug_transformation_process(processor=bounding_box_extractor, img_handler=img_handler, state=BoundingBoxExtractionState.FINAL_BOUNDING_BOXES)
     print("Text Bounding Boxes Extraction Completed: \ndebug img: " + bbox_extraction_step_debug_path + "\n")
@@ -155,14 +162,15 @@ def retrieve_csv(image_path:str, background_color:str, icons_colors:list[tuple[i
     # ocr extraction
     ocr_table = perform_ocr(
         bounding_box_array=table_bounding_box_array, 
-        extracted_table_path=extracted_table_path,
+        image=image_with_extracted_table,
         initial_img_path=image_path, 
-        slices_folder=OCR_SLICES_FOLDER_PATH)
+        slices_folder=OCR_SLICES_FOLDER_PATH,
+        max_workers=ocr_max_workers)
     print("OCR Completed: \n")
     print(ocr_table)
     
     # ocr saving as csv
-    # cleans first the bullet point incorrectly recognized
+    # cleans first the bullet point incorrectly recognized, the rows are cleaned while being written
     ocr_cleaned_table = ocr_result_processing.clean_bullet_points(raw_table=ocr_table)
     csv_path = ocr_result_processing.store_table_as_csv(table=ocr_cleaned_table, column_names=COLUMN_NAMES, csv_name=img_handler.get_image_name())
     print("CSV Table Saved: \n" + csv_path + "\n")
@@ -185,7 +193,8 @@ def main():
     retrieve_csv(
         image_path=image_path,
         background_color=background_color,
-        icons_colors=icons_colors
+        icons_colors=icons_colors,
+        debug=True
         )
 
     # for i in range(1):
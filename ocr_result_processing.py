@@ -1,41 +1,55 @@
 import re
+import csv
+from itertools import islice
+from collections.abc import Iterable, Iterator
 from pathlib import Path
 
-import pandas as pd
 
+# bullet points are wrongly recognized as these characters
+# the single characters followed by a space are grouped in a character class, tested in one step instead of one alternative each
+BULLET_POINT_PATTERN = re.compile(r"[.*+«‘]\s| - ")
 
-def clean_bullet_points(raw_table:list[list[str]]):
-    # bullet points are wrongly recognized as these characters
-    pattern = r"\.\s|\*\s|\+\s|\«\s|\‘\s| \- "
-
-    clean_list = []
+def clean_bullet_points(raw_table:list[list[str]]) -> Iterator[list[str]]:
+    '''
+    Yields the rows of the table, with a new row for each bullet point item incorrectly recognized in the 2 last columns.
+    The rows are produced one at a time, so they can be written as they are cleaned.
+    - raw_table: the table recognized by OCR
+    '''
     for row in raw_table:
-        wine_types = row[1]
-        wine_appelations = row[2]
+        # each cell is split once, the number of bullet points found is the number of splits
+        wine_types = BULLET_POINT_PATTERN.split(row[1])
+        # most rows have no bullet point, the appelations are then not scanned at all
+        if len(wine_types) == 1:
+            yield row
+            continue
+        wine_appelations = BULLET_POINT_PATTERN.split(row[2])
         # checks whether we have bullet points incorrectly identified on both 2 last columns
-        if len(re.findall(pattern, wine_types)) == len(re.findall(pattern, wine_appelations)) and len(re.findall(pattern, wine_types)) > 0:
-            # the first element of the re.split() is not text as inital text starts with a bullet point
-            cleaned_wine_types = [wine_type.strip() for wine_type in re.split(pattern, wine_types)[1:]]
-            cleaned_wine_appelations = [wine_type.strip() for wine_type in re.split(pattern, wine_appelations)[1:]]
+        if len(wine_types) == len(wine_appelations):
+            # the first element of the split is not text as inital text starts with a bullet point,
+            # it is skipped while iterating instead of copying the splits without it
             # creates a new line for each bullet point item
-            for w_type, w_appelation in list(zip(cleaned_wine_types, cleaned_wine_appelations)):
-                new_line = [row[0], w_type, w_appelation]
-                clean_list.append(new_line)     
+            yield from (
+                [row[0], w_type.strip(), w_appelation.strip()] 
+                for w_type, w_appelation in islice(zip(wine_types, wine_appelations), 1, None)
+                )
         else: 
-            clean_list.append(row)
-    return clean_list
+            yield row
 
-def store_table_as_csv(table:list[list[str]], column_names:list[str], csv_name:str, row_delimiter: str = "|") -> str:
+def store_table_as_csv(table:Iterable[list[str]], column_names:list[str], csv_name:str, row_delimiter: str = "|") -> str:
     '''
     Stores the table as a .csv file.
-    - table: table to store in the csv
+    - table: table to store in the csv, its rows are written as they are iterated
     - column_names: name of the columns of the csv
     - csv_name: the name of the csv file, without the extension
     - row_delimiter: delimiter for the file, defaulted to '|'
     '''
-    df = pd.DataFrame(data=table, columns=column_names)
     path = "outputs/" + csv_name + ".csv"
-    df.to_csv(path_or_buf=Path(path), sep="|")
+    # the table is a few dozen rows at most, it is written as is without building a DataFrame
+    # no index column is written, like when the table is edited and saved from the app
+    with open(Path(path), "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file, delimiter=row_delimiter)
+        writer.writerow(column_names)
+        writer.writerows(table)
     return path
 
 
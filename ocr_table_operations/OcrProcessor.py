@@ -1,12 +1,20 @@
 from dataclasses import dataclass, field
 from enum import StrEnum, Enum
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from bisect import bisect_right
 import re
 
+from PIL import Image as PILImage
+from tesserocr import PyTessBaseAPI, OEM, RIL, iterate_level
+
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
@@ -26,17 +34,178 @@ class TesseractPsm(Enum):
 
 @dataclass
 class TesseractOcr:
+    '''
+    Wraps a long-lived Tesseract engine, so the language model is loaded only once for all the slices of a table.
+    - language: the language of the text we want to recognize with OCR
+    '''
     language: TesseractLanguage
-    text_image_path: str
     _page_segmentation_mode: TesseractPsm = field(default_factory= lambda: TesseractPsm.DEFAULT)
 
-    # oem 3, default parameter, see tesseract --help-oem in cmd for more details
+    # oem 1, only the LSTM engine is loaded and run, see tesseract --help-oem in cmd for more details
     # more info here: https://github.com/tesseract-ocr/tesseract/blob/main/doc/tesseract.1.asc 
-    def run_ocr(self):
-        return subprocess.getoutput(f'tesseract {self.text_image_path} - -l {self.language.value} --oem 3 --psm {self._page_segmentation_mode.value}')
+    def __post_init__(self):
+        self._api = PyTessBaseAPI(lang=self.language.value, psm=self._page_segmentation_mode.value, oem=OEM.LSTM_ONLY)
+        # the text is dark on a light background, so the lines recognized with a low confidence are not read a second time inverted
+        self._api.SetVariable("tessedit_do_invert", "0")
+
+    def run_ocr(self, image:image_processing.Image) -> str:
+        '''
+        Returns the text recognized in the image.
+        - image: the mathematical representation of the BGR image containing the text
+        '''
+        # tesserocr expects PIL images, which are stored in RGB
+        self._api.SetImage(PILImage.fromarray(image_processing.convert_image_from_bgr_to_rgb(image=image)))
+        return self._api.GetUTF8Text()
+
+    def run_ocr_per_text_line(self, image:image_processing.Image, in_place: bool = False) -> list[tuple[str, int, int]]:
+        '''
+        Returns the text of each line recognized in the image, along with the y coordinates of the top and the bottom (excluded) of the line.
+        - image: the mathematical representation of the BGR image containing the text
+        - in_place: if True, the image is converted to RGB in its own buffer, for images which are not used after the OCR
+        '''
+        self._api.SetImage(PILImage.fromarray(image_processing.convert_image_from_bgr_to_rgb(image=image, in_place=in_place)))
+        self._api.Recognize()
+        text_lines = []
+        for line in iterate_level(self._api.GetIterator(), RIL.TEXTLINE):
+            bounding_box = line.BoundingBox(RIL.TEXTLINE)
+            if bounding_box is None:
+                continue
+            _, top_y, _, bottom_y = bounding_box
+            text_lines.append((line.GetUTF8Text(RIL.TEXTLINE), top_y, bottom_y))
+        return text_lines
     
     def set_page_segmentation_mode(self, psm:TesseractPsm) -> None:
         self._page_segmentation_mode = psm
+        self._api.SetPageSegMode(psm.value)
+
+    def close(self) -> None:
+        self._api.End()
+
+### OCR WORKERS
+
+NEW_LINE_PATTERN = re.compile(r'\r?\n')
+
+# height in px of the blank band separating two slices once stacked in a single image
+SLICES_SEPARATOR_HEIGHT = 20
+
+def clean_ocr_output(output:str) -> str:
+    '''
+    Removes '\n' char for the .csv creation, and removes any leading or ending whitespace.
+    - output: the text extracted via OCR
+    '''
+    return NEW_LINE_PATTERN.sub(' ', output).strip()
+
+def apply_ocr(ocr_engine:TesseractOcr, image:image_processing.Image) -> str:
+    '''
+    Applies ocr for the slice provided on its own.
+    - ocr_engine: the tesseract OCR engine
+    - image: the mathematical representation of the slice containing the text
+    '''
+    # most of the time, we will perform OCR on single lines of text
+    ocr_engine.set_page_segmentation_mode(psm=TesseractPsm.SINGLE_TEXT_LINE)
+    output = ocr_engine.run_ocr(image=image)
+    # if OCR fails, most presumably we provided more than a line, so we need to apply OCR with a different mode
+    if clean_ocr_output(output=output) == "":
+        ocr_engine.set_page_segmentation_mode(psm=TesseractPsm.SEVERAL_TEXT_LINES)
+        output = ocr_engine.run_ocr(image=image)
+    return clean_ocr_output(output=output)
+
+def assign_text_lines_to_slices(text_lines:list[tuple[str, int, int]], slices_y_ranges:list[tuple[int, int]]) -> list[list[str] | None]:
+    '''
+    Returns the text lines recognized in the stacked image which belong to each slice, in the order of the slices.
+    None is returned for a slice whose text can't be told apart in the stacked image: when no line was found in it,
+    or when a line was read across several slices or within a separator, as its text can't be split between the slices.
+    - text_lines: the text lines recognized in the stacked image, with the y coordinates of their top and bottom (excluded)
+    - slices_y_ranges: the y coordinates of the top and bottom (excluded) of each slice in the stacked image, from top to bottom
+    '''
+    start_y_values = [start_y for start_y, _ in slices_y_ranges]
+    slices_text_lines = [[] for _ in slices_y_ranges]
+    ambiguous_slices = set()
+    for text_line, top_y, bottom_y in text_lines:
+        # the slices are stacked from top to bottom, so the slices a line can overlap follow each other
+        first_slice = max(bisect_right(start_y_values, top_y) - 1, 0)
+        last_slice = max(bisect_right(start_y_values, bottom_y - 1) - 1, 0)
+        overlapped_slices = [
+            k for k in range(first_slice, last_slice + 1) 
+            if top_y < slices_y_ranges[k][1] and bottom_y > slices_y_ranges[k][0]
+            ]
+        if len(overlapped_slices) == 1:
+            slices_text_lines[overlapped_slices[0]].append(text_line)
+        else:
+            # a line within a separator is attributed to the slices on both sides of it
+            ambiguous_slices.update(overlapped_slices or [first_slice, min(first_slice + 1, len(slices_y_ranges) - 1)])
+    return [
+        None if k in ambiguous_slices or len(text_lines) == 0 else text_lines 
+        for k, text_lines in enumerate(slices_text_lines)
+        ]
+
+def apply_batch_ocr(ocr_engine:TesseractOcr, images:list[image_processing.Image]) -> list[str]:
+    '''
+    Applies ocr once for all the slices provided, and returns the text recognized for each of them.
+    The slices whose text can't be told apart in the stacked image are read again on their own, see assign_text_lines_to_slices.
+    - ocr_engine: the tesseract OCR engine, shared by all the slices processed by the same worker.
+    - images: the mathematical representations of the slices containing the text
+    '''
+    if len(images) == 0:
+        return []
+    # the slices are stacked in a single image, so Tesseract setup and layout analysis are only paid once
+    stacked_image, start_y_values = image_processing.stack_images_vertically(images=images, separator_height=SLICES_SEPARATOR_HEIGHT)
+    slices_y_ranges = [(start_y, start_y + image.shape[0]) for start_y, image in zip(start_y_values, images)]
+    # slices can contain several lines, so the stacked image is read as a block of text
+    ocr_engine.set_page_segmentation_mode(psm=TesseractPsm.SEVERAL_TEXT_LINES)
+    # the stacked image is only built for the OCR, so it is converted to RGB without allocating a copy of it
+    text_lines = ocr_engine.run_ocr_per_text_line(image=stacked_image, in_place=True)
+    slices_text_lines = assign_text_lines_to_slices(text_lines=text_lines, slices_y_ranges=slices_y_ranges)
+    # each text line ends with a new line, so the lines of a slice are cleaned like a slice read as a block of text
+    return [
+        apply_ocr(ocr_engine=ocr_engine, image=image) if slice_text_lines is None else clean_ocr_output(output="".join(slice_text_lines))
+        for image, slice_text_lines in zip(images, slices_text_lines)
+        ]
+
+
+@dataclass
+class TesseractOcrPool:
+    '''
+    Holds the Tesseract engines shared by the OCR threads. A Tesseract engine is not thread-safe, 
+    but several engines can recognize text concurrently, so each engine is only lent to one thread at a time.
+    The engines are ended when leaving the context, which releases their language models.
+    - language: the language of the text we want to recognize with OCR
+    - nbr_engines: the number of engines, at least the number of threads performing OCR
+    '''
+    language: TesseractLanguage
+    nbr_engines: int
+
+    def __post_init__(self):
+        self._engines = Queue()
+        try:
+            for _ in range(self.nbr_engines):
+                self._engines.put(TesseractOcr(language=self.language))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> "TesseractOcrPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def apply_batch_ocr(self, images:list[image_processing.Image]) -> list[str]:
+        '''
+        Applies ocr once for all the slices provided with one of the engines of the pool, see apply_batch_ocr.
+        - images: the mathematical representations of the slices containing the text
+        '''
+        ocr_engine = self._engines.get()
+        try:
+            return apply_batch_ocr(ocr_engine=ocr_engine, images=images)
+        finally:
+            self._engines.put(ocr_engine)
+
+    def close(self) -> None:
+        # the engines are all back in the queue once the threads using them are done
+        while not self._engines.empty():
+            self._engines.get().close()
+
 
 @dataclass
 class OrcProcessor:
@@ -48,6 +217,8 @@ class OrcProcessor:
     - table_column_names: a list containing the name of the columns from the table, from left to right. Size should be the same as the expected number of columns.
     It is used to label the cropped pictures.
     - language: the language of the text we want to recognize with OCR
+    - max_workers: (Optional) the number of threads performing OCR in parallel, defaulted to one per column
+    - store_slices: (Optional) if True, the slices are stored in images_folder_path for debugging purposes. OCR is performed in memory either way.
     '''
     table_bounding_box_array: list
     image: image_processing.Image
@@ -55,28 +226,43 @@ class OrcProcessor:
     images_folder_path: str
     table_column_names: list[str]
     language: TesseractLanguage
+    max_workers: int | None = None
+    store_slices: bool = False
+
+    def __post_init__(self):
+        # the handler only provides the naming conventions of the slices, it is shared by all of them
+        self._img_handler = image_processing.ImageHandler(image_path=self.original_image_path)
 
     def run(self) -> list[list[str]]:
-        table = []
+        # collects first all the slices of the table per column, with the row they belong to
+        slices_per_column = [[] for _ in self.table_column_names]
         image_number = 0
         for i in range(len(self.table_bounding_box_array)):
-            text_current_row = []
             # get the rows bounding boxes per columns, for the i-th row of the table
             column_rows = [self.table_bounding_box_array[i][0][j] for j in range(len(self.table_column_names))]
             # creates the slices for the OCR for the rows bounding boxes in the columns
             for k in range(len(column_rows)):
-                cropped_text_boxes_images = self.slice_text_box_from_image(column_row_bounding_boxes=column_rows[k])
-                ocr_outputs = []
-                # gets the text recognized at the column level
-                for box in cropped_text_boxes_images:
-                    box_path = self.store_cropped_image(col_name=self.table_column_names[k], image_number=image_number, image=box)
-                    ocr_engine = TesseractOcr(language=self.language, text_image_path=box_path)
-                    output = self.apply_ocr(ocr_engine=ocr_engine)
-                    ocr_outputs.append(output)
+                for box in self.slice_text_box_from_image(column_row_bounding_boxes=column_rows[k]):
+                    if self.store_slices:
+                        self.store_cropped_image(col_name=self.table_column_names[k], image_number=image_number, image=box)
+                    slices_per_column[k].append((i, box))
                     image_number += 1
-                text_current_row.append(" ".join(ocr_outputs))
-            table.append(text_current_row)
-        return table  
+
+        # Tesseract is single-threaded per call and CPU bound, tesserocr releases the GIL during the recognition,
+        # so the columns are dispatched to a pool of threads without copying the slices to other processes,
+        # each column being read in a single OCR call
+        max_workers = self.max_workers or len(self.table_column_names)
+        # the executor is shut down before the pool, so every engine is back in the pool when the engines are ended
+        with TesseractOcrPool(language=self.language, nbr_engines=max_workers) as ocr_pool:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                ocr_outputs_per_column = list(executor.map(ocr_pool.apply_batch_ocr, [[box for _, box in column_slices] for column_slices in slices_per_column]))
+
+        # gets the text recognized at the column level, keeping the order of the slices within a cell
+        table = [[[] for _ in self.table_column_names] for _ in self.table_bounding_box_array]
+        for k in range(len(slices_per_column)):
+            for (i, _), output in zip(slices_per_column[k], ocr_outputs_per_column[k]):
+                table[i][k].append(output)
+        return [[" ".join(cell_outputs) for cell_outputs in row] for row in table]
 
     def slice_text_box_from_image(self, column_row_bounding_boxes:list[BoundingBox]) -> list[image_processing.Image]:
         '''
@@ -98,34 +284,10 @@ class OrcProcessor:
         - image_number: the order number at which the image was processed
         - image: the mathematical representation of the cropped image to store
         '''
-        cropped_image_name = col_name + str(image_number) + ".jpg"
-        img_handler = image_processing.ImageHandler(image_path=self.original_image_path)
-        path = img_handler.store_image(folder_path=self.images_folder_path, file_name=cropped_image_name, image=image)
+        # BMP is written without any encoding, and keeps the exact pixels read by the OCR
+        cropped_image_name = col_name + str(image_number) + ".bmp"
+        path = self._img_handler.store_image(folder_path=self.images_folder_path, file_name=cropped_image_name, image=image)
         return path
-    
-    def clean_ocr_output(self, output:str):
-        '''
-        Removes '\n' char for the .csv creation, and removes any leading or ending whitespace.
-        - output: the text extracted via OCR
-        '''
-        new_line_pattern = r'\r?\n'
-        if len(re.findall(new_line_pattern, output)) > 0:
-            output = re.sub(new_line_pattern, ' ', output)
-        return output.strip()
-    
-    def apply_ocr(self, ocr_engine:TesseractOcr) -> str:
-        '''
-        Applies ocr for the slice provided.
-        - ocr_engine: the tesseract OCR engine, configured for the slice.
-        '''
-        # most of the time, we will perform OCR on single lines of text
-        ocr_engine.set_page_segmentation_mode(psm=TesseractPsm.SINGLE_TEXT_LINE)
-        output = ocr_engine.run_ocr()
-        # if OCR fails, most presumably we provided more than a line, so we need to apply OCR with a different mode
-        if output == "":
-            ocr_engine.set_page_segmentation_mode(psm=TesseractPsm.SEVERAL_TEXT_LINES)
-            output = ocr_engine.run_ocr()
-        return self.clean_ocr_output(output=output)
 
 
 def main():
@@ -140,7 +302,8 @@ def main():
         original_image_path="images/IMG_0148.jpg",
         images_folder_path=images_folder_path,
         table_column_names=["meal_name", "wine_types", "wine_appelations"],
-        language=TesseractLanguage.FRENCH
+        language=TesseractLanguage.FRENCH,
+        store_slices=True
     )
 
     ocr_table = ocr_processor.run()
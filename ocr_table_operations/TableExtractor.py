@@ -1,16 +1,24 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from typing import ClassVar
 from enum import StrEnum, auto
+from math import hypot
+
+import numpy as np
+from numba import njit
 
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
-from cv_operations.ColorFilter import ColorFilter, Color
-from cv_operations.ImagePreProcessor import ImagePreProcessor, Thresholder, GlobalThresholder, GlobalOptimizedThresholder
-from cv_operations.MorphologicalTransformer import MorphologicalTransformer, MorphologicalOperation
+from cv_operations.ColorFilter import ColorFilter, Color, COLOR_FILTER_KERNEL
+from cv_operations.ImagePreProcessor import ImagePreProcessor, Thresholder, GlobalThresholder, GlobalOptimizedThresholder, get_inverted_thresholder
+from cv_operations.MorphologicalTransformer import MorphologicalTransformer, MorphologicalOperation, DEFAULT_KERNEL
 
 
 class TableExtractionState(StrEnum):
@@ -21,6 +29,35 @@ class TableExtractionState(StrEnum):
     TABLE_EXTRACTION = auto()
 
 
+# a real table edge further from its optimal edge than this share of the optimal table shorter side means the table frame was not found,
+# the limit is relative so it does not depend on the resolution of the photo
+MAX_EDGE_OFFSET_RATIO = 0.25
+# contours whose bounding box covers less than this share of the detection image are text or noise, they can't delimit the table.
+# The column lines split the table into cells, so the limit stays below the area of a cell (above 1% on the sample menus, text blobs below 0.1%)
+MIN_TABLE_CONTOUR_AREA_RATIO = 0.005
+
+# compiled once and cached on disk, the 4 table edges are searched in a single pass over the contours points
+@njit(cache=True, fastmath=True)
+def find_closest_points(points_x:np.ndarray, points_y:np.ndarray, targets_x:np.ndarray, targets_y:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns for each target the index of the closest point, along with the squared distance between them. Ties are resolved with the first point.
+    - points_x, points_y: the coordinates of the points to search from
+    - targets_x, targets_y: the coordinates of the targets
+    '''
+    nbr_targets = targets_x.shape[0]
+    closest_indexes = np.full(nbr_targets, -1, dtype=np.int64)
+    closest_squared_distances = np.full(nbr_targets, np.iinfo(np.int64).max, dtype=np.int64)
+    for i in range(points_x.shape[0]):
+        for k in range(nbr_targets):
+            dx = points_x[i] - targets_x[k]
+            dy = points_y[i] - targets_y[k]
+            squared_distance = dx * dx + dy * dy
+            if squared_distance < closest_squared_distances[k]:
+                closest_squared_distances[k] = squared_distance
+                closest_indexes[k] = i
+    return closest_indexes, closest_squared_distances
+
+
 @dataclass
 class RectangleEdges:
     top_left: tuple[int, int]
@@ -36,64 +73,107 @@ class TableExtractor:
     - image: the mathematical representation of the source image, \n
     - threshold: the thresholding method used to obtain a binary colored image, \n
     - background_color: (Optional) The RGB color of the background of the image, if its is different from the table internal color
+    - detection_scale: (Optional) the scale at which the table edges are detected, defaulted to half the resolution. 
+    The table is still extracted from the full resolution image, and the kernels are scaled with the image so they cover the same area at any scale.
+    - debug: (Optional) if True, the intermediate images are kept and the contours and table edges found are drawn on copies of the image, 
+    which are available as transformation states. Otherwise only the extracted table is kept.
+    - filtered_detection_image: (Optional) the downscaled image already filtered from its background color, before thresholding.
+    It is set after each run, so extractors comparing thresholders on the same image and detection scale can share it instead of filtering again.
     '''
     image: image_processing.Image
     thresholder: Thresholder
     background_color: tuple[int, int, int] | None = None
-    _transformation_states: list[str] = field(default_factory= lambda: [state.value for state in TableExtractionState])
+    detection_scale: float = 0.5
+    debug: bool = False
+    filtered_detection_image: image_processing.Image | None = None
+    # the states only depend on the enum, they are computed once for all the instances
+    _transformation_states: ClassVar[tuple[str, ...]] = tuple(state.value for state in TableExtractionState)
 
     def run(self) -> image_processing.Image:
         '''
         Extracts the table from the image provided and returns it with a white padding to ease future morphological transformations
         '''
+        # intermediate images are kept as locals, so they are released as soon as the next step consumed them
+        # they are only kept as attributes in debug mode, to be available as transformation states
+        # the table edges don't require the full resolution, so they are detected on a downscaled image
+        detection_image = image_processing.scale_image(image=self.image, scale=self.detection_scale)
+
         # preprocess image to remove color dependency
         # obtain an image with black background and white lines and characters
-        self.preprocessed_image = self.preprocess_image()
+        if self.filtered_detection_image is None:
+            self.filtered_detection_image = self.filter_detection_image(detection_image=detection_image)
+        preprocessed_image = self.preprocess_image(filtered_image=self.filtered_detection_image)
+        self.preprocessed_image = preprocessed_image if self.debug else None
         
         # apply dilation to make contours more recognizable
-        dilation_transformer = MorphologicalTransformer(image=self.preprocessed_image, operation=MorphologicalOperation.DILATION)
-        self.dilated_image = dilation_transformer.apply()
+        dilation_transformer = MorphologicalTransformer(
+            image=preprocessed_image, 
+            operation=MorphologicalOperation.DILATION, 
+            kernel=DEFAULT_KERNEL.scale(factor=self.detection_scale))
+        dilated_image = dilation_transformer.apply()
+        del preprocessed_image, dilation_transformer
+        self.dilated_image = dilated_image if self.debug else None
         
-        # start contour recognition
-        contours = image_processing.get_contours(image=self.dilated_image, collectHierarchy=False, useApproximation=True)
-        self.image_with_all_contours = self.image.copy()
-        self.visualize_contours(image=self.image_with_all_contours, contours=contours)
+        # start contour recognition, the contours of the holes are kept: once the background color is filtered,
+        # the background and the table frame form a single white area, which only the inner contour of the frame delimits
+        contours = image_processing.get_contours(image=dilated_image, collectHierarchy=False, useApproximation=True)
+        detection_shape = dilated_image.shape
+        del dilated_image
+        self.image_with_all_contours = None
+        if self.debug:
+            self.image_with_all_contours = detection_image.copy()
+            self.visualize_contours(image=self.image_with_all_contours, contours=contours)
+        del detection_image
         
-        # identify the table edges
-        table_edges = self.get_table_edges(contours=contours)
-        self.image_with_table_edges = self.image.copy()
-        self.visualize_table_edges(image=self.image_with_table_edges, table_edges=table_edges)
+        # identify the table edges, and brings them back to the original image coordinates
+        table_edges = self.scale_table_edges(table_edges=self.get_table_edges(contours=contours, image_shape=detection_shape), factor=1 / self.detection_scale)
+        self.image_with_table_edges = None
+        if self.debug:
+            self.image_with_table_edges = self.image.copy()
+            self.visualize_table_edges(image=self.image_with_table_edges, table_edges=table_edges)
         
         # extracts the table
         self.extracted_table_image = self.resize_image(table_edges=table_edges)
 
-        # stores the transformations for debugging purposes
-        self.transformation_states_mapping = self.get_transformation_states_mapping()
+        # stores the transformations for debugging purposes, the mapping is built once and returned by its getter
+        self.transformation_states_mapping = self.build_transformation_states_mapping()
 
         # adds padding to ease line detection for future morphological operations
         return image_processing.add_padding(image=self.extracted_table_image, percentage=5)
 
 
-    def preprocess_image(self) -> image_processing.Image: 
+    def filter_detection_image(self, detection_image:image_processing.Image) -> image_processing.Image: 
         '''
-        Applies background color filtering to the image and converts it to a binary image, with black background and white lines / characters.
+        Applies background color filtering to the image, it does not depend on the thresholder.
+        - detection_image: the downscaled image on which the table edges are detected
         '''
         if self.background_color != None:
-            color_filter = ColorFilter(color=Color(rgb_color=self.background_color), image=self.image)
-            self.filtered_image = self.filter_background_color(color_filter=color_filter)
-            image_preprocessor = ImagePreProcessor(image=self.filtered_image, thresholder=self.thresholder)
+            color_filter = ColorFilter(
+                color=Color(rgb_color=self.background_color), 
+                image=detection_image, 
+                kernel=COLOR_FILTER_KERNEL.scale(factor=self.detection_scale))
+            # the color mask is applied directly on the grayscale image, which is the only one used for thresholding
+            # so the masked image only has 1 channel instead of 3
+            grayscale_image = image_processing.convert_image_to_grayscale(image=detection_image)
+            image_to_threshold = self.filter_background_color(color_filter=color_filter, target_image=grayscale_image)
         # no need for background color filtering
         else:
-            self.filtered_image = None
-            image_preprocessor = ImagePreProcessor(image=self.image, thresholder=self.thresholder)
+            image_to_threshold = detection_image
+        return image_to_threshold
 
-        self.binary_image = self.convert_to_binary_representation(image_preprocessor=image_preprocessor)
+    def preprocess_image(self, filtered_image:image_processing.Image) -> image_processing.Image: 
+        '''
+        Converts the filtered image to a binary image, with black background and white lines / characters.
+        - filtered_image: the downscaled image filtered from its background color, it is left unchanged
+        '''
         # inversion is needed to perform dilation: as kernel shapes are created with white pixels,
         # we need the contours of the table which we want to dilate to be represented by white pixels
-        return image_processing.invert_image(image=self.binary_image)
+        # the inversion is done by the threshold itself, instead of an extra pass on the binary image
+        image_preprocessor = ImagePreProcessor(image=filtered_image, thresholder=get_inverted_thresholder(thresholder=self.thresholder))
+        return self.convert_to_binary_representation(image_preprocessor=image_preprocessor)
 
-    def filter_background_color(self, color_filter:ColorFilter) -> image_processing.Image:
-        return color_filter.filter()
+    def filter_background_color(self, color_filter:ColorFilter, target_image:image_processing.Image) -> image_processing.Image:
+        return color_filter.filter(target_image=target_image)
     
     def convert_to_binary_representation(self, image_preprocessor:ImagePreProcessor) -> image_processing.Image:
         return image_preprocessor.apply()
@@ -105,34 +185,25 @@ class TableExtractor:
     # was abandoned because it wouldn't always categorize the table contour as rectangular
     # Instead, we look for optimal coordinates of the edges of the table, then compute the real edges based on distances between point
     
-    def get_contour_extremums(self, contour:list) -> tuple[int,int,int,int]:
-        '''
-        Computes the extremum values for a contour coordinates, along both x and y axis 
-        - contour: a contour computed from the binary image analyzed
-        '''
-        x_values = [point[0][0] for point in contour]
-        y_values = [point[0][1] for point in contour]
-        x_max = max(x_values)
-        y_max = max(y_values)
-        x_min = min(x_values)
-        y_min = min(y_values)
-        return x_max, x_min, y_max, y_min
-    
-    def get_optimal_table_edges(self, contours:list) -> RectangleEdges:
+    def get_optimal_table_edges(self, contours_boxes:np.ndarray, image_shape:tuple[int, ...]) -> RectangleEdges:
         '''
         Computes the optimal edges of the table, if the image had no deformation.
-        - contours: contours from the image, here their approximation is expected to avoid noise
+        - contours_boxes: the bounding boxes of the contours, here their approximation is expected to avoid noise, 
+        as a (N,4) array in the format (x, y, width, height)
+        - image_shape: the shape of the binary image the contours were detected on
         '''
-        # intialize table contours
-        height, width = self.image.shape[0], self.image.shape[1]
-        x_max_table, x_min_table, y_max_table , y_min_table = 0, width,0, height
-        for contour in contours:
-            extremums = self.get_contour_extremums(contour=contour)
-            # adds margin to remove the picture frame coordinates which are also detected as contours
-            x_max_table = extremums[0] if extremums[0] > x_max_table and extremums[0] < width - 10 else x_max_table
-            x_min_table = extremums[1] if extremums[1] < x_min_table and extremums[1] > 10 else x_min_table
-            y_max_table = extremums[2] if extremums[2] > y_max_table and extremums[2] < height - 10 else y_max_table
-            y_min_table = extremums[3] if extremums[3] < y_min_table and extremums[3] > 10 else y_min_table
+        height, width = image_shape[0], image_shape[1]
+        x_min, y_min = contours_boxes[:, 0], contours_boxes[:, 1]
+        x_max = x_min + contours_boxes[:, 2] - 1
+        y_max = y_min + contours_boxes[:, 3] - 1
+        # adds margin to remove the picture frame coordinates which are also detected as contours
+        # the 10 px margin is expressed at full resolution
+        margin = 10 * self.detection_scale
+        # initial values are used when no contour lies within the margins
+        x_max_table = int(np.max(x_max[x_max < width - margin], initial=0))
+        x_min_table = int(np.min(x_min[x_min > margin], initial=width))
+        y_max_table = int(np.max(y_max[y_max < height - margin], initial=0))
+        y_min_table = int(np.min(y_min[y_min > margin], initial=height))
         return RectangleEdges(
             top_left=(x_min_table, y_min_table), 
             top_right=(x_max_table, y_min_table), 
@@ -140,42 +211,86 @@ class TableExtractor:
             bottom_left=(x_min_table, y_max_table)
             )
     
-    def calculate_distance(self, point1:tuple[int, int], point2:tuple[int, int]):
-        return ((point1[0]-point2[0])**2 + (point1[1]-point2[1])**2)**0.5
-
-    def get_closest_point(self, point: tuple[int, int], contours:list) -> tuple[int, int]:
+    def get_closest_points(self, targets:list[tuple[int, int]], points:np.ndarray, max_distance:float) -> list[tuple[int, int]]:
         '''
-        Calculates for a given point coordinates, which point of coordinates (x,y) from the contours detected in the image is the closest.
-        - point: one of the optimal edge for the table, as we want to find the real points before extracting the table
-        - contours: the list of approximated contours for the binary image
+        Calculates for each target point coordinates, which point of coordinates (x,y) from the contours detected in the image is the closest.
+        Raises a ValueError when the closest point is further than the maximum distance, as the table would be extracted from wrong edges.
+        - targets: the optimal edges for the table, as we want to find the real points before extracting the table
+        - points: the (x,y) coordinates of all the approximated contours points for the binary image, as a (N,2) array
+        - max_distance: the maximum distance between a target and its closest point
         '''
-        # initialization
-        closest_distance = 1000
-        closest_point = (0,0)
-        
-        # computes closest point
-        for contour in contours:
-            distances = [self.calculate_distance(point1=point, point2=(contour_pt[0][0], contour_pt[0][1])) for contour_pt in contour]
-            closest_pt_idx = distances.index(min(distances))
-            if distances[closest_pt_idx] < closest_distance:
-                closest_point = contour[closest_pt_idx]
-                closest_distance = distances[closest_pt_idx]
-
-        # returns the coordinates as a tupple as it is to be used in the RectangleEdges object attributes
-        return (closest_point[0][0], closest_point[0][1])
+        target_array = np.array(targets, dtype=np.int64).reshape(-1, 2)
+        closest_pt_indexes, closest_squared_distances = find_closest_points(
+            points_x=np.ascontiguousarray(points[:, 0]), 
+            points_y=np.ascontiguousarray(points[:, 1]), 
+            targets_x=target_array[:, 0], 
+            targets_y=target_array[:, 1]
+            )
+        closest_points = []
+        for target, closest_pt_idx, squared_distance in zip(targets, closest_pt_indexes, closest_squared_distances):
+            # without any contour point, the optimal edge itself is the best estimate of the table edge
+            if closest_pt_idx < 0:
+                closest_points.append((int(target[0]), int(target[1])))
+            elif squared_distance > max_distance ** 2:
+                closest_point = (int(points[closest_pt_idx, 0]), int(points[closest_pt_idx, 1]))
+                raise ValueError(f"The table edge {closest_point} is {squared_distance ** 0.5:.0f} px away from the optimal edge {target}, the table frame was not detected")
+            else:
+                # coordinates are returned as tupples as they are to be used in the RectangleEdges object attributes
+                closest_points.append((int(points[closest_pt_idx, 0]), int(points[closest_pt_idx, 1])))
+        return closest_points
     
-    def get_table_edges(self, contours:list) -> RectangleEdges:
+    def get_table_edges(self, contours:list, image_shape:tuple[int, ...]) -> RectangleEdges:
+        '''
+        Returns the real table edges, as the contours points closest to the optimal table edges.
+        - contours: the contours detected on the binary image, including the contours of the holes
+        - image_shape: the shape of the binary image the contours were detected on
+        '''
+        # the contours of the text and noise are discarded before being approximated and searched
+        table_contours = self.get_table_contours(contours=contours, image_shape=image_shape)
         # approximate contours to make it more robust to image noise
-        contour_approximations = [image_processing.get_contour_approximation(contour=contours[i], eps=0.02, isContourClosed=True) for i in range(len(contours))]
-        optimal_edges = self.get_optimal_table_edges(contours=contour_approximations)
+        contour_approximations = [image_processing.get_contour_approximation(contour=contour, eps=0.02, isContourClosed=True) for contour in table_contours]
+        # the extremums of each approximated contour are given by its bounding box, computed for all the contours at once
+        optimal_edges = self.get_optimal_table_edges(contours_boxes=image_processing.get_bounding_boxes(contours=contour_approximations), image_shape=image_shape)
+        # all the approximated points are gathered in a single array, to compute the edges in a single pass
+        points = np.vstack([approximation.reshape(-1, 2) for approximation in contour_approximations] + [np.empty((0, 2))]).astype(np.int64)
         # we want to find the real table points, to account for image deformations
-        return RectangleEdges(
-            top_left=self.get_closest_point(point=optimal_edges.top_left, contours=contour_approximations),
-            top_right=self.get_closest_point(point=optimal_edges.top_right, contours=contour_approximations),
-            bottom_right=self.get_closest_point(point=optimal_edges.bottom_right, contours=contour_approximations),
-            bottom_left=self.get_closest_point(point=optimal_edges.bottom_left, contours=contour_approximations)
-        )
+        # the limit is relative to the table size, a fixed distance limit rejected valid edges on high resolution photos
+        optimal_width = optimal_edges.bottom_right[0] - optimal_edges.top_left[0]
+        optimal_height = optimal_edges.bottom_right[1] - optimal_edges.top_left[1]
+        top_left, top_right, bottom_right, bottom_left = self.get_closest_points(
+            targets=[optimal_edges.top_left, optimal_edges.top_right, optimal_edges.bottom_right, optimal_edges.bottom_left], 
+            points=points,
+            max_distance=MAX_EDGE_OFFSET_RATIO * min(optimal_width, optimal_height)
+            )
+        return RectangleEdges(top_left=top_left, top_right=top_right, bottom_right=bottom_right, bottom_left=bottom_left)
+    
+    def get_table_contours(self, contours:list, image_shape:tuple[int, ...]) -> list:
+        '''
+        Returns the contours big enough to delimit the table, based on the area of their bounding box.
+        - contours: the contours detected on the binary image
+        - image_shape: the shape of the binary image the contours were detected on
+        '''
+        contours_boxes = image_processing.get_bounding_boxes(contours=contours)
+        min_area = MIN_TABLE_CONTOUR_AREA_RATIO * image_shape[0] * image_shape[1]
+        is_table_contour = contours_boxes[:, 2].astype(np.int64) * contours_boxes[:, 3] > min_area
+        return [contour for contour, is_kept in zip(contours, is_table_contour) if is_kept]
     
+    def scale_table_edges(self, table_edges:RectangleEdges, factor:float) -> RectangleEdges:
+        '''
+        Returns the table edges coordinates multiplied by the factor provided.
+        - table_edges: the coordinates of the table corner edges
+        - factor: the factor to apply, e.g. 2 to go from an image downscaled by half to the original image
+        '''
+        def scale(point:tuple[int,int]) -> tuple[int,int]:
+            return (round(point[0] * factor), round(point[1] * factor))
+        
+        return RectangleEdges(
+            top_left=scale(table_edges.top_left), 
+            top_right=scale(table_edges.top_right), 
+            bottom_right=scale(table_edges.bottom_right), 
+            bottom_left=scale(table_edges.bottom_left)
+            )
+
     def visualize_table_edges(self, image:image_processing.Image, table_edges:RectangleEdges) -> None:
         '''
         Draws on the image cercles to represent the 4 edges detected for the table with their coordinates.
@@ -194,8 +309,8 @@ class TableExtractor:
     def get_resized_image_dimensions(self, table_edges:RectangleEdges) -> tuple[int,int]:
         image_width = self.image.shape[1]
         image_width_reduced_by_10_percent = int(image_width * 0.9)
-        table_width = self.calculate_distance(point1=table_edges.top_left, point2=table_edges.top_right)
-        table_height = self.calculate_distance(point1=table_edges.top_left, point2=table_edges.bottom_left)
+        table_width = hypot(table_edges.top_right[0] - table_edges.top_left[0], table_edges.top_right[1] - table_edges.top_left[1])
+        table_height = hypot(table_edges.bottom_left[0] - table_edges.top_left[0], table_edges.bottom_left[1] - table_edges.top_left[1])
         aspect_ratio = table_height / table_width
         new_image_width = image_width_reduced_by_10_percent
         new_image_height = int(new_image_width * aspect_ratio)
@@ -213,6 +328,9 @@ class TableExtractor:
     ### TRANSFORMATION STATES HANDLING
 
     def get_transformation_states_mapping(self):
+        return self.transformation_states_mapping
+
+    def build_transformation_states_mapping(self):
         return {
             TableExtractionState.PREPROCESSING: self.preprocessed_image,
             TableExtractionState.DILATION: self.dilated_image,
@@ -221,7 +339,7 @@ class TableExtractor:
             TableExtractionState.TABLE_EXTRACTION: self.extracted_table_image
         }
     
-    def get_transformation_states(self):
+    def get_transformation_states(self) -> tuple[str, ...]:
         return self._transformation_states
 
 
@@ -233,14 +351,18 @@ def main():
     table_extractor_1 = TableExtractor(
         image=image,
         background_color=(135, 115, 105),
-        thresholder=GlobalThresholder()
+        thresholder=GlobalThresholder(),
+        debug=True
     )
     simple_threshold_extraction = table_extractor_1.run()
     # extraction with a global thresholder optimized with Otsu method
+    # the background filtering does not depend on the thresholder, it is shared with the first extraction
     table_extractor_2 = TableExtractor(
         image=image,
         background_color=(135, 115, 105),
-        thresholder=GlobalOptimizedThresholder()
+        thresholder=GlobalOptimizedThresholder(),
+        debug=True,
+        filtered_detection_image=table_extractor_1.filtered_detection_image
     )
     otsu_extraction = table_extractor_2.run()
 
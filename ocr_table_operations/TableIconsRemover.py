@@ -1,15 +1,19 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from typing import ClassVar
 from enum import StrEnum, auto
 
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
-from cv_operations.ColorFilter import ColorFilter, Color
-from cv_operations.ImagePreProcessor import ImagePreProcessor, Thresholder, GlobalThresholder
+from cv_operations.ColorFilter import Color, create_colors_mask, filter_masked_pixels
+from cv_operations.ImagePreProcessor import ImagePreProcessor, Thresholder, GlobalThresholder, get_inverted_thresholder
 from cv_operations.MorphologicalTransformer import MorphologicalTransformer, MorphologicalOperation
 
 
@@ -20,6 +24,18 @@ class IconRemovingState(StrEnum):
     ICONS_EROSION = auto()
     ICONS_DILATION = auto()
 
+# the kernel is the same for every image, it is created once when the module is loaded
+ICONS_KERNEL = image_processing.Kernel(
+    shape=image_processing.KernelShape.ELLIPSE, 
+    dimensions=(10,10) #trial and error, bigger it detects holes between letters and removes them
+    )
+# the closing only fills the small gaps of the icons mask, where the kernel shape barely matters:
+# a rectangle is separable, OpenCV applies it as a row pass followed by a column pass
+ICONS_CLOSING_KERNEL = image_processing.Kernel(
+    shape=image_processing.KernelShape.RECTANGLE, 
+    dimensions=(10,10)
+    )
+
 @dataclass
 class TableIconsRemover:
     '''
@@ -31,72 +47,58 @@ class TableIconsRemover:
     image: image_processing.Image
     thresholder: Thresholder
     icon_colors: list[tuple[int, int, int]]
-    _transformation_states: list[str] = field(default_factory= lambda: [state.value for state in IconRemovingState])
+    # the states only depend on the enum, they are computed once for all the instances
+    _transformation_states: ClassVar[tuple[str, ...]] = tuple(state.value for state in IconRemovingState)
 
     def run(self) -> image_processing.Image: 
         '''
         Removes the icons from the image
         '''
         hsv = image_processing.convert_image_to_hsv(image=self.image)
-        icons_kernel = image_processing.Kernel(
-            shape=image_processing.KernelShape.ELLIPSE, 
-            dimensions=(10,10) #trial and error, bigger it detects holes between letters and removes them
-            )
         
         # remove colors from icons and turn them to black pixels
-        color_masks = [
-            ColorFilter(
-                color=Color(rgb_color=color), 
-                image=self.image,
-                hue_tolerance=5 #helps targeting better the colors
-                ).create_color_mask(hsv=hsv)  for color in self.icon_colors]   
-        self.filtered_image = self.filter_icons(color_masks=color_masks, kernel=icons_kernel)
-        image_preprocessor = ImagePreProcessor(image=self.filtered_image, thresholder=self.thresholder)
-        binary_image = self.convert_to_binary_representation(image_preprocessor=image_preprocessor)
+        # sometimes color masks overlap, if we just sum them they cancel each other
+        # therefore the mask is the union of the colors, computed in a single pass over the image
+        icons_mask = create_colors_mask(
+            hsv=hsv, 
+            colors=[Color(rgb_color=color) for color in self.icon_colors], 
+            hue_tolerance=5 #helps targeting better the colors
+            )
+        self.filtered_image = self.filter_icons(icons_mask=icons_mask, kernel=ICONS_CLOSING_KERNEL)
         # inversion is needed to perform dilation: as kernel shapes are created with white pixels,
         # we need the contours of the table which we want to dilate to be represented by white pixels
-        self.inverted_binary_image = image_processing.invert_image(image=binary_image)
+        # the inversion is done by the threshold itself, instead of an extra pass on the binary image
+        image_preprocessor = ImagePreProcessor(image=self.filtered_image, thresholder=get_inverted_thresholder(thresholder=self.thresholder))
+        self.inverted_binary_image = self.convert_to_binary_representation(image_preprocessor=image_preprocessor)
         
         # erosion of the icons
+        # the ellipse is approximated by iterations of a 3,3 cross, the icons only need to be covered, not outlined exactly
         erosion_transformer = MorphologicalTransformer(
             image=self.inverted_binary_image, 
             operation=MorphologicalOperation.EROSION, 
-            kernel=icons_kernel,
-            nbr_iterations=2)
+            kernel=ICONS_KERNEL,
+            nbr_iterations=2,
+            fast_approx=True)
         self.eroded_icons_image = self.erode_icons(erosion_transformer=erosion_transformer)
         
         # following a dilation to ensure all icons pixels are considered
         dilation_transformer = MorphologicalTransformer(
             image=self.eroded_icons_image, 
             operation=MorphologicalOperation.DILATION, 
-            kernel=icons_kernel, 
-            nbr_iterations=5)
+            kernel=ICONS_KERNEL, 
+            nbr_iterations=5,
+            fast_approx=True)
         self.dilated_icons_image = self.dilate_icons(dilation_transformer=dilation_transformer)
         # remove icons pixels from image
         return self.subtract_icons_from_original_image()
 
-    def filter_icons(self, color_masks:list[ColorFilter], kernel:image_processing.Kernel) -> image_processing.Image:
+    def filter_icons(self, icons_mask:image_processing.Image, kernel:image_processing.Kernel) -> image_processing.Image:
         '''
         Masks the icons from the image: icons will appear with black pixels on the image.
-        - color_masks: the masks applied to perform color filtering
+        - icons_mask: the mask of the pixels having the color of any icon
         - kernel: the kernel used to apply morphological transformations on the icons
         '''
-        # sometimes color masks overlap, if we just sum them they cancel each other
-        # therefore we compute the union of the masks instead when combining them
-        mask = color_masks[0]
-        if len(color_masks) > 1:
-            for i in range(1,len(color_masks)):
-                mask = mask | color_masks[i]
-        # apply a morphology operation, closing: it results in a Dilation followed by Erosion
-        # helps filling small pixel gaps in an area (e.g. holes in a shape because of different lighting conditions)
-        closing_transformer = MorphologicalTransformer(
-            image=mask, 
-            operation=MorphologicalOperation.CLOSING,
-            kernel=kernel)
-        morph = closing_transformer.apply()
-        # filters
-        mask_filter = 255 - morph
-        return image_processing.apply_bitwise_and(image1=self.image, image2=self.image, mask=mask_filter)
+        return filter_masked_pixels(image=self.image, mask=icons_mask, kernel=kernel)
     
     def convert_to_binary_representation(self, image_preprocessor:ImagePreProcessor) -> image_processing.Image:
         return image_preprocessor.apply()
@@ -121,7 +123,7 @@ class TableIconsRemover:
             IconRemovingState.ICONS_DILATION: self.dilated_icons_image,
         }
     
-    def get_transformation_states(self):
+    def get_transformation_states(self) -> tuple[str, ...]:
         return self._transformation_states
 
 def main():
@@ -1,10 +1,15 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from typing import ClassVar
 from enum import StrEnum, auto
+from concurrent.futures import ThreadPoolExecutor
 
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
@@ -19,6 +24,11 @@ class LinesRemovingState(StrEnum):
     VERTICAL_LINES_DILATION = auto()
     ALL_LINES_DILATION = auto()
 
+# the kernel is the same for every image, it is created once when the module is loaded
+LINES_THICKENING_KERNEL = image_processing.Kernel(
+    shape=image_processing.KernelShape.RECTANGLE,
+    dimensions=(5,5)
+)
 
 @dataclass
 class TableLinesRemover:
@@ -31,7 +41,8 @@ class TableLinesRemover:
     image: image_processing.Image
     vertical_lines_kernel: image_processing.Kernel
     horizontal_lines_kernel: image_processing.Kernel
-    _transformation_states: list[str] = field(default_factory= lambda: [state.value for state in LinesRemovingState])
+    # the states only depend on the enum, they are computed once for all the instances
+    _transformation_states: ClassVar[tuple[str, ...]] = tuple(state.value for state in LinesRemovingState)
 
     def run(self) -> image_processing.Image: 
         '''
@@ -41,52 +52,46 @@ class TableLinesRemover:
         # this avoids bugs later by converting to 2 channels
         image_preprocessor = ImagePreProcessor(image=self.image, thresholder=GlobalThresholder())
         self.binary_image = self.convert_to_binary_representation(image_preprocessor=image_preprocessor)
-        ### horizontal lines
-        # erosion
-        h_erosion_transformer = MorphologicalTransformer(
-            image=self.binary_image, 
-            operation=MorphologicalOperation.EROSION, 
-            kernel=self.horizontal_lines_kernel,
-            nbr_iterations=10) # attribute value found by experimenting with the images
-        self.horizontally_eroded_image = self.erode_lines(erosion_transformer=h_erosion_transformer)
-        # following a dilation to ensure all pixels are considered
-        h_dilation_transformer = MorphologicalTransformer(
-            image=self.horizontally_eroded_image, 
-            operation=MorphologicalOperation.DILATION, 
-            kernel=self.horizontal_lines_kernel,
-            nbr_iterations=10)
-        self.horizontally_dilated_image = self.dilate_lines(dilation_transformer=h_dilation_transformer)
-        
-        ### vertical lines
-        # erosion
-        v_erosion_transformer = MorphologicalTransformer(
-            image=self.binary_image, 
-            operation=MorphologicalOperation.EROSION, 
-            kernel=self.vertical_lines_kernel,
-            nbr_iterations=10)
-        self.vertically_eroded_image = self.erode_lines(erosion_transformer=v_erosion_transformer)
-        # dilation
-        v_dilation_transformer = MorphologicalTransformer(
-            image=self.vertically_eroded_image, 
-            operation=MorphologicalOperation.DILATION, 
-            kernel=self.vertical_lines_kernel,
-            nbr_iterations=10)
-        self.vertically_dilated_image = self.dilate_lines(dilation_transformer=v_dilation_transformer)
+        # horizontal and vertical lines are extracted independently from the binary image,
+        # OpenCV releases the GIL during the morphological operations so both directions run in parallel threads
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            horizontal_lines = executor.submit(self.extract_lines, lines_kernel=self.horizontal_lines_kernel)
+            vertical_lines = executor.submit(self.extract_lines, lines_kernel=self.vertical_lines_kernel)
+            self.horizontally_eroded_image, self.horizontally_dilated_image = horizontal_lines.result()
+            self.vertically_eroded_image, self.vertically_dilated_image = vertical_lines.result()
         
         ### remove lines from image
         combined_extracted_lines_image = self.combine_lines_dilations()
         # We apply a final dilation to thicken the lines
-        dilation_kernel = image_processing.Kernel(
-            shape=image_processing.KernelShape.RECTANGLE,
-            dimensions=(5,5)
-        )
         dilation_transformer = MorphologicalTransformer(
             image=combined_extracted_lines_image, 
             operation=MorphologicalOperation.DILATION, 
-            kernel=dilation_kernel)
+            kernel=LINES_THICKENING_KERNEL)
         self.all_dilated_lines_image = self.dilate_lines(dilation_transformer=dilation_transformer)
         return self.subtract_lines_from_original_image(image=self.all_dilated_lines_image)
     
+    def extract_lines(self, lines_kernel:image_processing.Kernel) -> tuple[image_processing.Image, image_processing.Image]:
+        '''
+        Returns the eroded and dilated images of the binary image, which only keep the lines along the kernel direction.
+        - lines_kernel: the kernel used to extract the lines, horizontal or vertical
+        '''
+        # OpenCV merges the iterations of a rectangle kernel into a single pass of the equivalent larger kernel,
+        # keeping the anchor of the iterated kernel, so the iterations cost no more than one operation
+        # erosion
+        erosion_transformer = MorphologicalTransformer(
+            image=self.binary_image, 
+            operation=MorphologicalOperation.EROSION, 
+            kernel=lines_kernel,
+            nbr_iterations=10) # attribute value found by experimenting with the images
+        eroded_image = self.erode_lines(erosion_transformer=erosion_transformer)
+        # following a dilation to ensure all pixels are considered
+        dilation_transformer = MorphologicalTransformer(
+            image=eroded_image, 
+            operation=MorphologicalOperation.DILATION, 
+            kernel=lines_kernel,
+            nbr_iterations=10)
+        return eroded_image, self.dilate_lines(dilation_transformer=dilation_transformer)
+
     def convert_to_binary_representation(self, image_preprocessor:ImagePreProcessor) -> image_processing.Image:
         return image_preprocessor.apply()
     
@@ -97,7 +102,8 @@ class TableLinesRemover:
         return dilation_transformer.apply()
     
     def combine_lines_dilations(self) -> image_processing.Image:
-        return image_processing.add_images(image1=self.horizontally_dilated_image, image2=self.vertically_dilated_image)
+        # the lines images are binary, so their union gives the same result as a saturated addition with simpler operations
+        return image_processing.apply_bitwise_or(image1=self.horizontally_dilated_image, image2=self.vertically_dilated_image)
     
     def subtract_lines_from_original_image(self, image:image_processing.Image) -> image_processing.Image:
         '''
@@ -119,12 +125,13 @@ class TableLinesRemover:
             LinesRemovingState.ALL_LINES_DILATION: self.all_dilated_lines_image
         }
     
-    def get_transformation_states(self):
+    def get_transformation_states(self) -> tuple[str, ...]:
         return self._transformation_states
 
 def main():
     img_handler = image_processing.ImageHandler(image_path="images/debug/abat_1_otsu_image_without_icons.jpg")
-    image = img_handler.load_image()
+    # the image without icons is a binary image, a single channel is enough
+    image = img_handler.load_image(grayscale=True)
     
     table_lines_remover = TableLinesRemover(
         image=image,
@@ -1,10 +1,18 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from typing import ClassVar, Callable
+from collections.abc import Mapping, Iterator
 from enum import StrEnum, auto
+from itertools import chain
+
+import numpy as np
 
 # allows modules to access modules from outside the package
 import sys
 import os
-sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/.."))
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
 
 # import modules from the project
 import image_processing as image_processing
@@ -26,166 +34,215 @@ class BoundingBoxExtractionState(StrEnum):
 
 type BoundingBox = tuple[int, int, int, int]
 
+def to_bounding_boxes(boxes:np.ndarray) -> list[BoundingBox]:
+    # the rest of the pipeline works with tuples of Python integers, which can be hashed and drawn by OpenCV
+    return [tuple(box) for box in boxes.tolist()]
+
+class RenderedStatesMapping(Mapping):
+    '''
+    Maps the transformation states to their images, an image is only rendered when its state is looked up.
+    - states: the states available in the mapping
+    - render_state: the function returning the image of a state
+    '''
+    def __init__(self, states:tuple[str, ...], render_state:Callable[[str], image_processing.Image | None]):
+        self._states = states
+        self._render_state = render_state
+
+    def __getitem__(self, state:str) -> image_processing.Image | None:
+        if state not in self._states:
+            raise KeyError(state)
+        return self._render_state(state)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._states)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
 @dataclass
 class TextBoundingBoxExtractor:
     '''
     Extracts all the bounding box containg the text to extract from the table, organized by columns
     - image: the mathematical representation of the binary image we want to extract the text from, with the text in white and the lines already removed
     - original_image: the mathematical representation of the image with the table extracted without processing, for debugging purposes
+    - debug: (Optional) if True, the bounding boxes found at each step can be drawn on copies of the original image, which are available as transformation states.
+    The copies are only made for the states looked up, not for every step of the extraction
+    - blobs_downscale_factor: (Optional) the factor by which the binary image is reduced before detecting the text blobs,
+    the blobs are much bigger than a pixel so they are found with less work on a smaller image. By default the full resolution is kept
     '''
     image: image_processing.Image
     original_image: image_processing.Image
-    _transformation_states: list[str] = field(default_factory= lambda: [state.value for state in BoundingBoxExtractionState])
+    debug: bool = False
+    blobs_downscale_factor: int = 1
+    # the states only depend on the enum, they are computed once for all the instances
+    _transformation_states: ClassVar[tuple[str, ...]] = tuple(state.value for state in BoundingBoxExtractionState)
 
-    def run(self) -> tuple[dict[str,list[BoundingBox]], list[BoundingBox]]:
+    def run(self) -> tuple[dict[int,list[BoundingBox]], list[BoundingBox]]:
         # when an image loads with imread, it loads it with 3 channels even when black and white pixels only
         # this avoids bugs during contour detection by converting to 2 channels
         image_preprocessor = ImagePreProcessor(image=self.image, thresholder=GlobalThresholder())
         self.binary_image = self.convert_to_binary_representation(image_preprocessor=image_preprocessor)
         # dilates text to be able to get the text blobs
-        self.text_dilated_image = self.create_blobs(image=self.binary_image)
+        reduced_image = self.reduce_binary_image(image=self.binary_image)
+        # the binary image is only an intermediate outside debug mode, the dilation is then written into it instead of a new image.
+        # A reduced image is always an intermediate
+        dst = reduced_image if reduced_image is not self.binary_image or not self.debug else None
+        self.text_dilated_image = self.create_blobs(image=reduced_image, dst=dst)
 
-        # detects the blobs contours
-        contours = image_processing.get_contours(image=self.text_dilated_image, collectHierarchy=True, useApproximation=True)
-        # draws blobs on original image for clean debugging
-        self.image_with_blobs = self.original_image.copy()
-        image_processing.draw_contours(image=self.image_with_blobs, contours=contours)
+        # detects the blobs contours, only their outer contours are needed for the bounding boxes:
+        # the hierarchy is never used and a hole left inside a blob would only add a box within the text box
+        contours = image_processing.get_contours(image=self.text_dilated_image, useApproximation=True, onlyExternal=True)
+        # the blobs are kept to be drawn on the original image for clean debugging
+        self.blobs_contours = contours
 
-        # detects the bounding boxes
-        all_bounding_boxes = [image_processing.get_bounding_box(contour=contour) for contour in contours]
-        # draws bounding boxes on original image for clean debugging
-        self.image_with_all_bounding_boxes = self.original_image.copy()
-        self.visualize_bounding_boxes(image=self.image_with_all_bounding_boxes, bounding_boxes=all_bounding_boxes)
+        # detects the bounding boxes, they are filtered and sorted as a single (N,4) array
+        all_boxes = image_processing.get_bounding_boxes(contours=contours)
+        # the boxes found on the reduced image are brought back to the coordinates of the full resolution image
+        all_boxes *= self.blobs_downscale_factor
 
         ### removes the bounding boxes unwanted, due to imperfect lines / icons erosion
         # computes unwanted bounding boxes
-        unwanted_bounding_boxes_1 = self.get_unwanted_bounding_boxes(all_bounding_boxes=all_bounding_boxes)
-        self.image_with_unwanted_bounding_boxes_1 = self.original_image.copy()
-        self.visualize_bounding_boxes(image=self.image_with_unwanted_bounding_boxes_1, bounding_boxes=unwanted_bounding_boxes_1)
+        is_unwanted_box = self.get_unwanted_bounding_boxes_mask(boxes=all_boxes)
+        unwanted_bounding_boxes_1 = to_bounding_boxes(boxes=all_boxes[is_unwanted_box])
         # computes updated bounding boxes
-        self.image_with_corrected_bounding_boxes = self.original_image.copy()
-        corrected_bounding_boxes = self.update_bounding_boxes(image_with_updated_boxes=self.image_with_corrected_bounding_boxes, all_boxes=all_bounding_boxes, unwanted_boxes=unwanted_bounding_boxes_1)
+        corrected_boxes = all_boxes[~is_unwanted_box]
 
         ### sorts the bounding boxes by columns
-        sorted_by_x_boxes = self.sort_bounding_boxes_by_x_coordinate(bounding_boxes=corrected_bounding_boxes)
-        columns = self.sort_ordered_bounding_boxes_by_columns(bounding_boxes=sorted_by_x_boxes)
+        sorted_by_x_boxes = self.sort_bounding_boxes_by_x_coordinate(boxes=corrected_boxes)
+        columns = self.sort_ordered_bounding_boxes_by_columns(boxes=sorted_by_x_boxes)
         # removes the bounding boxes which result from longer lines not properly eroded which formed extra columns in the table
         table_columns, unwanted_bounding_boxes_2 = self.clean_table_columns(table_columns=columns, expected_col_number=3)
         
-        ### visualize all identified incorrect boxes
-        # second iteration of incorrect boxes identification
-        self.image_with_unwanted_bounding_boxes_2 = self.original_image.copy()
-        self.visualize_bounding_boxes(image=self.image_with_unwanted_bounding_boxes_2, bounding_boxes=unwanted_bounding_boxes_2)
-        # all identified incorrect boxes
-        self.image_with_all_incorrect_bounding_boxes = self.original_image.copy()
-        self.visualize_bounding_boxes(image=self.image_with_all_incorrect_bounding_boxes, bounding_boxes=unwanted_bounding_boxes_1 + unwanted_bounding_boxes_2)
-
-        ### visualize all correct boxes identified
-        self.image_with_final_bounding_boxes = self.original_image.copy()
-        correct_bounding_boxes = self.update_bounding_boxes(image_with_updated_boxes=self.image_with_final_bounding_boxes, all_boxes=corrected_bounding_boxes, unwanted_boxes=unwanted_bounding_boxes_2)
-    
+        correct_bounding_boxes = self.get_correct_bounding_boxes(table_columns=table_columns)
+
+        ### keeps the bounding boxes found at each step for clean debugging
+        # the boxes are only drawn on a copy of the original image when the state is looked up
+        self.bounding_boxes_by_state = {
+            BoundingBoxExtractionState.ALL_BOUNDING_BOXES: all_boxes,
+            BoundingBoxExtractionState.UNWANTED_BOUNDING_BOXES_1: unwanted_bounding_boxes_1,
+            BoundingBoxExtractionState.CORRECTED_BOUNDING_BOXES: corrected_boxes,
+            BoundingBoxExtractionState.UNWANTED_BOUNDING_BOXES_2: unwanted_bounding_boxes_2,
+            BoundingBoxExtractionState.ALL_INCORRECT_BOUNDING_BOXES: unwanted_bounding_boxes_1 + unwanted_bounding_boxes_2,
+            BoundingBoxExtractionState.FINAL_BOUNDING_BOXES: correct_bounding_boxes
+        }
         return table_columns, correct_bounding_boxes
 
 
     def convert_to_binary_representation(self, image_preprocessor:ImagePreProcessor) -> image_processing.Image:
         return image_preprocessor.apply()
 
-    def create_blobs(self, image:image_processing.Image) -> image_processing.Image:
-        # first dilation helps creating the blobs
-        first_dilation_transformer = MorphologicalTransformer(
+    def reduce_binary_image(self, image:image_processing.Image) -> image_processing.Image:
+        '''
+        Returns the binary image reduced by the blobs downscale factor, with every text pixel kept.
+        - image: the binary image, with the text in white
+        '''
+        if self.blobs_downscale_factor == 1:
+            return image
+        reduced_image = image_processing.scale_image(image=image, scale=1 / self.blobs_downscale_factor)
+        # the area interpolation averages the pixels, any reduced pixel covering some text is set back to white
+        # so the thin strokes of the letters are not lost before the dilation
+        return image_processing.apply_simple_binary_threshold(image=reduced_image, threshold_value=0, dst=reduced_image)
+
+    def create_blobs(self, image:image_processing.Image, dst:image_processing.Image | None = None) -> image_processing.Image:
+        # dilations with rectangular kernels compose into a single rectangular dilation whose size is the sum of the kernels extents:
+        # 5 iterations of a (10,2) kernel help creating the blobs, 2 iterations of a (5,5) kernel remove the remaining gaps inside blobs, 
+        # e.g. to get accents in the main block. Together they amount to one (5*9 + 2*4 + 1, 5*1 + 2*4 + 1) = (54,14) dilation, 
+        # which OpenCV applies as one horizontal and one vertical pass. Its anchor is the sum of the kernels anchors,
+        # (5*5 + 2*2, 5*1 + 2*2) = (29,9) rather than the center, so the blobs are not moved compared to the successive dilations.
+        # The kernel and its anchor are reduced along with the image
+        width, height = max(1, round(54 / self.blobs_downscale_factor)), max(1, round(14 / self.blobs_downscale_factor))
+        dilation_transformer = MorphologicalTransformer(
             image=image,
             operation=MorphologicalOperation.DILATION,
             kernel=image_processing.Kernel(
                 shape=image_processing.KernelShape.RECTANGLE,
-                dimensions=(10,2)
-            ),
-            nbr_iterations=5
+                dimensions=(width, height),
+                anchor=(min(width - 1, round(29 / self.blobs_downscale_factor)), min(height - 1, round(9 / self.blobs_downscale_factor)))
+            )
         ) 
-        first_dilation = first_dilation_transformer.apply()
-        # second dilation removes the remaining gaps inside blobs, e.g. to get accents in the main block
-        second_dilation_transformer = MorphologicalTransformer(
-            image=first_dilation,
-            operation=MorphologicalOperation.DILATION,
-            kernel=image_processing.Kernel(
-                shape=image_processing.KernelShape.RECTANGLE,
-                dimensions=(5,5)
-            ),
-            nbr_iterations=2
-        ) 
-        return second_dilation_transformer.apply()
+        return dilation_transformer.apply(dst=dst)
     
-    def get_mean_box_height(self, bounding_boxes:list[BoundingBox]) -> float:
+    def get_mean_box_height(self, bounding_boxes:list[BoundingBox] | np.ndarray) -> float:
         '''
         Get the mean height of the text bounding boxes provided.
         - bounding_boxes: list of the bounding boxes, in the format (top-left-corner_x, top-left-corner_y, box_width, box_height)
         '''
-        bounding_box_heights = [box[3] for box in bounding_boxes]
-        return sum(bounding_box_heights) / len(bounding_box_heights)
+        return float(np.asarray(bounding_boxes).reshape(-1, 4)[:, 3].mean())
 
-    def get_unwanted_bounding_boxes(self, all_bounding_boxes:list[BoundingBox]) -> list[BoundingBox]:
-        mean_box_height = self.get_mean_box_height(bounding_boxes=all_bounding_boxes)
+    def get_unwanted_bounding_boxes_mask(self, boxes:np.ndarray) -> np.ndarray:
+        '''
+        Returns the mask of the bounding boxes unwanted, which are too small to contain text.
+        - boxes: the bounding boxes as a (N,4) array, in the format (top-left-corner_x, top-left-corner_y, box_width, box_height)
+        '''
+        # the mean of an empty array is undefined, when no box was detected there is none to remove
+        if len(boxes) == 0:
+            return np.zeros(0, dtype=bool)
+        mean_box_height = self.get_mean_box_height(bounding_boxes=boxes)
         #text boxes have more or less the same size, under this threshold it is certainly a line
-        return [box for box in all_bounding_boxes if box[3] < (mean_box_height / 1.5)]
+        return boxes[:, 3] < (mean_box_height / 1.5)
     
-    def get_correct_bounding_boxes(self, all_bounding_boxes:list[BoundingBox], unwanted_bounding_boxes:list[BoundingBox]) -> list[BoundingBox]:
-        all_box_set = {box for box in all_bounding_boxes}
-        unwanted_box_set = {box for box in unwanted_bounding_boxes}
-        correct_box_set = all_box_set.symmetric_difference(unwanted_box_set)
-        return list(correct_box_set)
+    def get_correct_bounding_boxes(self, table_columns:dict[int,list[BoundingBox]]) -> list[BoundingBox]:
+        '''
+        Returns the bounding boxes of the columns kept in the table, from left to right.
+        - table_columns: the columns of the table, once the columns made of table lines were removed
+        '''
+        # the boxes removed with the extra columns are exactly the boxes of these columns,
+        # so the correct boxes are gathered from the columns kept instead of being compared with the removed ones
+        return [box for column_boxes in table_columns.values() for box in column_boxes]
     
-    def update_bounding_boxes(self, image_with_updated_boxes:image_processing.Image, all_boxes: list[BoundingBox], unwanted_boxes:list[BoundingBox]):
-        correct_bounding_boxes = self.get_correct_bounding_boxes(all_bounding_boxes=all_boxes, unwanted_bounding_boxes=unwanted_boxes)
-        self.visualize_bounding_boxes(image=image_with_updated_boxes, bounding_boxes=correct_bounding_boxes)
-        return correct_bounding_boxes
+    def render_state(self, state:str) -> image_processing.Image | None:
+        '''
+        Returns the image of a transformation state. The blobs and bounding boxes are drawn on a copy of the original image.
+        None is returned when not in debug mode, to avoid copying the image, as well as for the binary image which is then overwritten by the dilation.
+        - state: the transformation state to render, one of the BoundingBoxExtractionState values
+        '''
+        if state == BoundingBoxExtractionState.TEXT_DILATION:
+            return self.text_dilated_image
+        if not self.debug:
+            return None
+        if state == BoundingBoxExtractionState.BINARY_REPRESENTATION:
+            return self.binary_image
+        image = self.original_image.copy()
+        if state == BoundingBoxExtractionState.BLOBS:
+            # the blobs are drawn at the scale of the original image
+            image_processing.draw_contours(image=image, contours=[contour * self.blobs_downscale_factor for contour in self.blobs_contours])
+        else:
+            self.visualize_bounding_boxes(image=image, bounding_boxes=self.bounding_boxes_by_state[state])
+        return image
          
-    def visualize_bounding_boxes(self,image:image_processing.Image, bounding_boxes:list[BoundingBox]) -> None:
+    def visualize_bounding_boxes(self,image:image_processing.Image, bounding_boxes:list[BoundingBox] | np.ndarray) -> None:
         '''
         Draws the bounding boxes on the image.
         - image: the mathematical representantion of the image where we want to draw the boxes
-        - bounding_boxes: list of the bounding boxes, in the format (top-left-corner_x, top-left-corner_y, box_width, box_height)
+        - bounding_boxes: list or (N,4) array of the bounding boxes, in the format (top-left-corner_x, top-left-corner_y, box_width, box_height)
         '''
-        for box in bounding_boxes:
-            top_left_corner = (box[0], box[1])
-            bottom_right_corner = (box[0] + box[2], box[1] + box[3])
-            image_processing.draw_rectangle(image=image, top_left_point=top_left_corner, bottom_right_point=bottom_right_corner)
+        image_processing.draw_rectangles(image=image, boxes=np.asarray(bounding_boxes, dtype=np.int32))
     
-    def sort_bounding_boxes_by_x_coordinate(self, bounding_boxes:list[BoundingBox]) -> list[BoundingBox]:
+    def sort_bounding_boxes_by_x_coordinate(self, boxes:np.ndarray) -> np.ndarray:
         '''
         Sorts the bounding boxes based on their top-left corner x coordinate.
+        - boxes: the bounding boxes as a (N,4) array
         '''
-        return sorted(bounding_boxes, key=lambda x: x[0])
+        # the sort is stable, so boxes with the same x coordinate keep their detection order
+        return boxes[np.argsort(boxes[:, 0], kind="stable")]
     
-    def sort_ordered_bounding_boxes_by_columns(self, bounding_boxes:list[BoundingBox]) -> dict[str,list[BoundingBox]]:
+    def sort_ordered_bounding_boxes_by_columns(self, boxes:np.ndarray, column_x_tolerance:int = 30) -> dict[int,list[BoundingBox]]:
         '''
         Sorts the bounding boxes by columns. 
-        - bounding_boxes: the list of bounding boxes, ordered by x coordinates
+        - boxes: the bounding boxes as a (N,4) array, ordered by x coordinates
+        - column_x_tolerance: the maximum gap between the top-left corner x coordinates of two consecutive boxes from the same column,
+        which accounts for perspective distortion
         '''
-        # initialization
-        columns = {}
-        k = 1
-        columns[f"{k}"] = [bounding_boxes[0]]
-        mid_interval = columns[f"{k}"][0][0]
-        column_x_values = [mid_interval]
-        for i in range(1,len(bounding_boxes)):
-            x = bounding_boxes[i][0]
-            # we compute the range of x values where the top left corner of the 
-            # bounding box should lie, by accounting for perspective distortion
-            column_start_interval = range(mid_interval - 30, mid_interval + 30)
-            # as the boxes are ordered by top-left corner x coordinates, if the x value
-            # doesn't belong to the interval anymore, we reached a new column of the table
-            if x in column_start_interval:
-                columns[f"{k}"].append(bounding_boxes[i])
-                column_x_values.append(bounding_boxes[i][0])
-                #we want to have a centered mid_interval, as we have a tendency to see x increase for a column because of the perspective distortion
-                mid_interval = sum(column_x_values) // len(column_x_values) 
-            else:
-                k+=1
-                columns[f"{k}"] = [bounding_boxes[i]]
-                column_x_values = [bounding_boxes[i][0]]
-                mid_interval = columns[f"{k}"][0][0]
-        return columns
+        # without any box there is no column, rather than a single empty one
+        if len(boxes) == 0:
+            return {}
+        # as the boxes are ordered by top-left corner x coordinates, a gap bigger than the tolerance
+        # between two consecutive boxes means we reached a new column of the table
+        column_starts = np.flatnonzero(np.diff(boxes[:, 0]) > column_x_tolerance) + 1
+        # the boxes are only turned into tuples once split, as the columns are handed to the rest of the pipeline
+        return {k+1: to_bounding_boxes(boxes=column_boxes) for k, column_boxes in enumerate(np.split(boxes, column_starts))}
     
-    def clean_table_columns(self, table_columns:dict[str,list[BoundingBox]], expected_col_number:int) -> tuple[dict[str,list[BoundingBox]],list[BoundingBox]]:
+    def clean_table_columns(self, table_columns:dict[int,list[BoundingBox]], expected_col_number:int) -> tuple[dict[int,list[BoundingBox]],list[BoundingBox]]:
         '''
         Removes from the columns storing the bounding boxes of the table the ones which can be associated with
         bigger portions of table lines which were not completely eroded. It also provides the nex incorrect boxes detected.
@@ -193,53 +250,44 @@ class TextBoundingBoxExtractor:
         and as values a list of the bounding boxes which were found in the column
         - expected_col_number: number of columns expected for the table
         '''
-        incorrect_boxes = []
-        columns = table_columns.copy()
-        columns_length = {k : len(columns[k]) for k in columns.keys()}
-        if len(columns_length) > expected_col_number: 
-            while len(columns_length) != expected_col_number:
-                # removes the column which has the less boundary boxes
-                min_key = min(columns_length, key = columns_length.get)
-                incorrect_boxes += columns[min_key]
-                del columns_length[min_key]
-                del columns[min_key]
+        nbr_extra_columns = len(table_columns) - expected_col_number
+        if nbr_extra_columns <= 0:
+            return table_columns, []
+        # removes the columns which have the less boundary boxes, the sort is stable so the leftmost column goes first on ties
+        extra_columns = sorted(table_columns, key=lambda k: len(table_columns[k]))[:nbr_extra_columns]
+        incorrect_boxes = list(chain.from_iterable(table_columns[k] for k in extra_columns))
+        # the columns kept stay ordered from left to right
+        columns = {k: boxes for k, boxes in table_columns.items() if k not in extra_columns}
         return columns, incorrect_boxes
     
     
     ### TRANSFORMATION STATES HANDLING
 
     def get_transformation_states_mapping(self):
-        return {
-            BoundingBoxExtractionState.BINARY_REPRESENTATION: self.binary_image,
-            BoundingBoxExtractionState.TEXT_DILATION: self.text_dilated_image,
-            BoundingBoxExtractionState.BLOBS: self.image_with_blobs,
-            BoundingBoxExtractionState.ALL_BOUNDING_BOXES: self.image_with_all_bounding_boxes,
-            BoundingBoxExtractionState.UNWANTED_BOUNDING_BOXES_1: self.image_with_unwanted_bounding_boxes_1,
-            BoundingBoxExtractionState.CORRECTED_BOUNDING_BOXES: self.image_with_corrected_bounding_boxes,
-            BoundingBoxExtractionState.UNWANTED_BOUNDING_BOXES_2: self.image_with_unwanted_bounding_boxes_2,
-            BoundingBoxExtractionState.ALL_INCORRECT_BOUNDING_BOXES: self.image_with_all_incorrect_bounding_boxes,
-            BoundingBoxExtractionState.FINAL_BOUNDING_BOXES: self.image_with_final_bounding_boxes
-        }
+        # the debug images are full copies of the original image, they are only rendered for the states looked up
+        return RenderedStatesMapping(states=tuple(BoundingBoxExtractionState), render_state=self.render_state)
     
-    def get_transformation_states(self):
+    def get_transformation_states(self) -> tuple[str, ...]:
         return self._transformation_states
 
 
 def main():
     img_handler = image_processing.ImageHandler(image_path="images/debug/abat_1_otsu_image_without_icons_and_without_lines.jpg")
-    image = img_handler.load_image()
+    # the image without icons and lines is a binary image, a single channel is enough
+    image = img_handler.load_image(grayscale=True)
 
     original_img_handler = image_processing.ImageHandler(image_path="images/debug/abat_1_otsu.jpg")
     original_image = original_img_handler.load_image()
 
     bounding_box_extractor = TextBoundingBoxExtractor(
         image=image,
-        original_image=original_image
+        original_image=original_image,
+        debug=True
     )
     table_columns, bounding_boxes = bounding_box_extractor.run()
 
     folder_path = "images/debug/"
-    img_path_1 = img_handler.store_image(file_name="box_extraction.jpg", folder_path=folder_path, image=bounding_box_extractor.image_with_final_bounding_boxes)
+    img_path_1 = img_handler.store_image(file_name="box_extraction.jpg", folder_path=folder_path, image=bounding_box_extractor.render_state(state=BoundingBoxExtractionState.FINAL_BOUNDING_BOXES))
     img_path_2 = img_handler.store_debug_image(
         folder_path=folder_path,
         state_mapping=bounding_box_extractor.get_transformation_states_mapping(),
@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+
+# allows modules to access modules from outside the package
+import sys
+import os
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# import modules from the project
+from ocr_table_operations.OcrProcessor import TesseractPsm, SLICES_SEPARATOR_HEIGHT, apply_batch_ocr, assign_text_lines_to_slices
+
+
+SLICE_HEIGHT = 40
+
+class StubOcrEngine:
+    '''
+    Replaces the Tesseract engine, the text lines of the stacked image are provided and each slice is recognized from its pixel value.
+    - text_lines: the text lines returned for the stacked image, with the y coordinates of their top and bottom
+    - slices_texts: the text returned for a slice read on its own, per page segmentation mode and pixel value of the slice
+    '''
+    def __init__(self, text_lines:list[tuple[str, int, int]], slices_texts:dict[TesseractPsm, dict[int, str]]):
+        self.text_lines = text_lines
+        self.slices_texts = slices_texts
+        self.single_slice_calls = []
+
+    def set_page_segmentation_mode(self, psm:TesseractPsm) -> None:
+        self.psm = psm
+
+    def run_ocr_per_text_line(self, image:np.ndarray, in_place:bool = False) -> list[tuple[str, int, int]]:
+        return self.text_lines
+
+    def run_ocr(self, image:np.ndarray) -> str:
+        pixel_value = int(image[0, 0, 0])
+        self.single_slice_calls.append((pixel_value, self.psm))
+        return self.slices_texts.get(self.psm, {}).get(pixel_value, "")
+
+def create_slices(nbr_slices:int) -> list[np.ndarray]:
+    # each slice is filled with its own pixel value, so the stub engine can tell them apart
+    return [np.full((SLICE_HEIGHT, 100, 3), k + 1, dtype=np.uint8) for k in range(nbr_slices)]
+
+def get_slice_y_range(k:int) -> tuple[int, int]:
+    start_y = k * (SLICE_HEIGHT + SLICES_SEPARATOR_HEIGHT)
+    return start_y, start_y + SLICE_HEIGHT
+
+
+class TestAssignTextLinesToSlices(unittest.TestCase):
+
+    def test_lines_within_slices(self):
+        slices_y_ranges = [get_slice_y_range(k) for k in range(3)]
+        text_lines = [("Taboulé", 2, 18), ("Tarama", 60, 78), ("aux anchois", 80, 98), ("Lirac", 122, 140)]
+        self.assertEqual(
+            assign_text_lines_to_slices(text_lines=text_lines, slices_y_ranges=slices_y_ranges),
+            [["Taboulé"], ["Tarama", "aux anchois"], ["Lirac"]]
+            )
+
+    def test_line_across_separator(self):
+        # Tesseract merged the lines of the first two slices, their text can't be split between them
+        slices_y_ranges = [get_slice_y_range(k) for k in range(3)]
+        text_lines = [("Taboulé Tarama", 20, 80), ("Lirac", 122, 140)]
+        self.assertEqual(
+            assign_text_lines_to_slices(text_lines=text_lines, slices_y_ranges=slices_y_ranges),
+            [None, None, ["Lirac"]]
+            )
+
+    def test_line_within_separator(self):
+        slices_y_ranges = [get_slice_y_range(k) for k in range(3)]
+        text_lines = [("Taboulé", 2, 18), ("-", 45, 55), ("Lirac", 122, 140)]
+        self.assertEqual(
+            assign_text_lines_to_slices(text_lines=text_lines, slices_y_ranges=slices_y_ranges),
+            [None, None, ["Lirac"]]
+            )
+
+    def test_slice_without_line(self):
+        slices_y_ranges = [get_slice_y_range(k) for k in range(2)]
+        self.assertEqual(
+            assign_text_lines_to_slices(text_lines=[("Taboulé", 2, 18)], slices_y_ranges=slices_y_ranges),
+            [["Taboulé"], None]
+            )
+
+
+class TestApplyBatchOcr(unittest.TestCase):
+
+    def test_slices_read_from_stacked_image(self):
+        ocr_engine = StubOcrEngine(text_lines=[("Taboulé\n", 2, 18), ("Tarama\n", 60, 78), ("aux anchois\n", 80, 98)], slices_texts={})
+        self.assertEqual(apply_batch_ocr(ocr_engine=ocr_engine, images=create_slices(nbr_slices=2)), ["Taboulé", "Tarama aux anchois"])
+        self.assertEqual(ocr_engine.single_slice_calls, [])
+
+    def test_merged_slices_read_on_their_own(self):
+        ocr_engine = StubOcrEngine(
+            text_lines=[("Taboulé Tarama\n", 20, 80), ("Lirac\n", 122, 140)],
+            slices_texts={TesseractPsm.SINGLE_TEXT_LINE: {1: "Taboulé\n", 2: "Tarama\n"}}
+            )
+        self.assertEqual(apply_batch_ocr(ocr_engine=ocr_engine, images=create_slices(nbr_slices=3)), ["Taboulé", "Tarama", "Lirac"])
+        self.assertEqual(ocr_engine.single_slice_calls, [(1, TesseractPsm.SINGLE_TEXT_LINE), (2, TesseractPsm.SINGLE_TEXT_LINE)])
+
+    def test_slice_without_line_falls_back_to_several_lines(self):
+        # the single line mode finds nothing in a slice with several lines, it is read again as a block of text
+        ocr_engine = StubOcrEngine(
+            text_lines=[("Taboulé\n", 2, 18)],
+            slices_texts={TesseractPsm.SEVERAL_TEXT_LINES: {2: "Tarama\naux anchois\n"}}
+            )
+        self.assertEqual(apply_batch_ocr(ocr_engine=ocr_engine, images=create_slices(nbr_slices=2)), ["Taboulé", "Tarama aux anchois"])
+        self.assertEqual(ocr_engine.single_slice_calls, [(2, TesseractPsm.SINGLE_TEXT_LINE), (2, TesseractPsm.SEVERAL_TEXT_LINES)])
+
+    def test_no_slice(self):
+        self.assertEqual(apply_batch_ocr(ocr_engine=StubOcrEngine(text_lines=[], slices_texts={}), images=[]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
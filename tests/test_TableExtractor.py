@@ -0,0 +1,83 @@
+import unittest
+
+import cv2
+import numpy as np
+
+# allows modules to access modules from outside the package
+import sys
+import os
+# the entry is only added once, even though every module of the packages runs this shim
+project_root = os.path.abspath(os.path.dirname(__file__) + "/..")
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# import modules from the project
+from ocr_table_operations.TableExtractor import TableExtractor
+from cv_operations.ImagePreProcessor import GlobalThresholder
+
+
+BACKGROUND_COLOR = (163, 130, 135)
+# the table frame, as (x_min, y_min, x_max, y_max) on the full resolution image
+TABLE_FRAME = (150, 130, 1050, 1470)
+
+def create_menu_image() -> np.ndarray:
+    '''
+    Draws a 3 columns menu table, whose dark frame lies directly on the colored background.
+    '''
+    image = np.full((1600, 1200, 3), BACKGROUND_COLOR[::-1], dtype=np.uint8)
+    x_min, y_min, x_max, y_max = TABLE_FRAME
+    cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (235, 235, 235), -1)
+    cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (20, 20, 20), 6)
+    for x in (450, 750):
+        cv2.line(image, (x, y_min), (x, y_max), (20, 20, 20), 3)
+    for y in range(y_min + 60, y_max, 120):
+        for x in (x_min + 30, 460, 760):
+            cv2.putText(image, "Vin rouge", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+    return image
+
+
+class TestTableExtractor(unittest.TestCase):
+
+    def test_table_frame_touching_filtered_background(self):
+        # once the background color is filtered, the background and the table frame form a single white area,
+        # the table must still be found from the inner contour of the frame
+        x_min, y_min, x_max, y_max = TABLE_FRAME
+        expected_aspect_ratio = (y_max - y_min) / (x_max - x_min)
+        for detection_scale in (1.0, 0.5):
+            with self.subTest(detection_scale=detection_scale):
+                table_extractor = TableExtractor(
+                    image=create_menu_image(),
+                    thresholder=GlobalThresholder(),
+                    background_color=BACKGROUND_COLOR,
+                    detection_scale=detection_scale
+                    )
+                table_extractor.run()
+                height, width = table_extractor.extracted_table_image.shape[:2]
+                self.assertAlmostEqual(height / width, expected_aspect_ratio, delta=0.03)
+
+    def test_table_edges_independent_of_detection_scale(self):
+        # the kernels are scaled with the detection image, so the table found does not depend on the detection scale
+        extracted_shapes = {}
+        for detection_scale in (1.0, 0.5, 0.25):
+            table_extractor = TableExtractor(
+                image=create_menu_image(),
+                thresholder=GlobalThresholder(),
+                background_color=BACKGROUND_COLOR,
+                detection_scale=detection_scale
+                )
+            table_extractor.run()
+            extracted_shapes[detection_scale] = table_extractor.extracted_table_image.shape[:2]
+        for detection_scale in (0.5, 0.25):
+            with self.subTest(detection_scale=detection_scale):
+                for size, full_resolution_size in zip(extracted_shapes[detection_scale], extracted_shapes[1.0]):
+                    self.assertLessEqual(abs(size - full_resolution_size), 2)
+
+    def test_table_edge_far_from_optimal_edge(self):
+        # an edge far from its optimal edge would extract a skewed table, it must fail instead
+        table_extractor = TableExtractor(image=create_menu_image(), thresholder=GlobalThresholder())
+        with self.assertRaises(ValueError):
+            table_extractor.get_closest_points(targets=[(100, 100)], points=np.array([[500, 400]]), max_distance=200)
+
+
+if __name__ == "__main__":
+    unittest.main()